@@ -0,0 +1 @@
+from .assets import AssetStore, Asset
\ No newline at end of file
@@ -0,0 +1,156 @@
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Mapping
+from starlette.responses import Response
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller files gain nothing from compression once the headers are counted
+MIN_COMPRESS_SIZE = 1024
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "image/svg+xml",
+)
+
+# File names under static/ carry a content hash, so browsers may keep them forever
+IMMUTABLE_PREFIX = "static/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+
+@dataclass
+class Asset():
+    body: bytes
+    gzip: bytes | None
+    br: bytes | None
+    media_type: str
+    etag: str
+    last_modified: str
+    mtime: int
+    cache_control: str
+
+
+class AssetStore():
+    _root: str
+    _assets: Dict[str, Asset]
+
+    def __init__(self, root: str):
+        self._root = root
+        self._assets = dict()
+
+    def load(self):
+        assets = dict()
+        total = 0
+
+        for (directory, _, names) in os.walk(self._root):
+            for name in names:
+                full_path = os.path.join(directory, name)
+                path = os.path.relpath(full_path, self._root).replace(os.sep, "/")
+                asset = self._load_asset(path, full_path)
+                assets[path] = asset
+                total += len(asset.body)
+
+        self._assets = assets
+        logging.info(f"Loaded { len(assets) } static assets ({ total // 1024 } KiB) from '{ self._root }'")
+
+    def _load_asset(self, path: str, full_path: str) -> Asset:
+        with open(full_path, "rb") as fp:
+            body = fp.read()
+
+        mtime = int(os.path.getmtime(full_path))
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+
+        gzip_body = None
+        br_body = None
+        if len(body) >= MIN_COMPRESS_SIZE and media_type.startswith(COMPRESSIBLE_TYPES):
+            gzip_body = _smaller(gzip.compress(body, compresslevel=9, mtime=0), body)
+            if brotli is not None:
+                br_body = _smaller(brotli.compress(body), body)
+
+        return Asset(
+            body=body,
+            gzip=gzip_body,
+            br=br_body,
+            media_type=media_type,
+            etag=f'"{ hashlib.sha1(body).hexdigest() }"',
+            last_modified=formatdate(mtime, usegmt=True),
+            mtime=mtime,
+            cache_control=IMMUTABLE_CACHE_CONTROL if path.startswith(IMMUTABLE_PREFIX) else REVALIDATE_CACHE_CONTROL)
+
+    def get(self, path: str) -> Asset | None:
+        return self._assets.get(path)
+
+    def response(self, path: str, request_headers: Mapping[str, str]) -> Response:
+        asset = self._assets.get(path)
+        if asset is None:
+            return Response(status_code=404)
+
+        headers = {
+            "ETag": asset.etag,
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if _not_modified(asset, request_headers):
+            return Response(status_code=304, headers=headers)
+
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        body = asset.body
+        if asset.br is not None and "br" in accepted:
+            body = asset.br
+            headers["Content-Encoding"] = "br"
+        elif asset.gzip is not None and "gzip" in accepted:
+            body = asset.gzip
+            headers["Content-Encoding"] = "gzip"
+
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+
+def _smaller(compressed: bytes, body: bytes) -> bytes | None:
+    return compressed if len(compressed) < len(body) else None
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for item in header.split(","):
+        (name, _, params) = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            accepted.add(name.lower())
+
+    return accepted
+
+
+def _not_modified(asset: Asset, request_headers: Mapping[str, str]) -> bool:
+    # If-None-Match wins over If-Modified-Since when a client sends both
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [ tag.strip().removeprefix("W/") for tag in if_none_match.split(",") ]
+        return "*" in tags or asset.etag in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return asset.mtime <= int(parsedate_to_datetime(if_modified_since).timestamp())
+        except (TypeError, ValueError):
+            return False
+
+    return False
@@ -0,0 +1,4 @@
+from .shipper import Shipper, LogShipper, push_log_url, push_feed_url
+from .hub import Hub, Subscription
+from .bus import Bus, drain_queue, expand_batch, LOG_QUEUE_SIZE, FEED_QUEUE_SIZE
+from .feed import StationCache, StationFeed, to_feed_rows
\ No newline at end of file
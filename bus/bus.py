@@ -0,0 +1,73 @@
+import queue
+import asyncio
+import logging
+import threading
+import multiprocessing as mp
+from typing import Any, Callable, Dict, List
+
+# Bound on batches in flight between the services and the web process
+LOG_QUEUE_SIZE = 1000
+FEED_QUEUE_SIZE = 1000
+
+
+def expand_batch(obj: Dict) -> List[Dict]:
+    # Shippers send batches, dashboard clients get one message per line
+    if "messages" in obj:
+        return [ { "type": obj.get("type"), "message": message } for message in obj["messages"] ]
+
+    return [ obj ]
+
+
+def drain_queue(source_queue: mp.Queue, name: str, is_running: Callable[[], bool], deliver: Callable[[Any], None]):
+    # mp.Queue.get() blocks, so callers run this on a thread of their own
+    while is_running():
+        try:
+            obj: Any = source_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        except (EOFError, OSError):
+            logging.warning(f"{ name } queue closed")
+            return
+
+        deliver(obj)
+
+
+class Bus():
+    _name: str
+    _on_message: Callable[[Any], None]
+    _queue: mp.Queue
+    _loop: asyncio.AbstractEventLoop
+    _thread: threading.Thread
+    _running: bool
+
+    def __init__(self, name: str, on_message: Callable[[Any], None]):
+        self._name = name
+        self._on_message = on_message
+        self._queue = None
+        self._loop = None
+        self._thread = None
+        self._running = False
+
+    def publish(self, obj: Any):
+        self._on_message(obj)
+
+    def start(self, source_queue: mp.Queue):
+        if source_queue is None or self._thread is not None:
+            return
+
+        self._queue = source_queue
+        self._loop = asyncio.get_running_loop()
+        self._running = True
+        self._thread = threading.Thread(target=self._drain, name=f"bus-{ self._name }", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _drain(self):
+        # Messages are handed to the event loop
+        drain_queue(
+            self._queue,
+            f"Bus '{ self._name }'",
+            lambda: self._running,
+            lambda obj: self._loop.call_soon_threadsafe(self.publish, obj))
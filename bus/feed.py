@@ -0,0 +1,147 @@
+import pytz
+from collections import deque
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterable, List, Set
+
+from .hub import Subscription
+
+FEED_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+
+
+def to_feed_rows(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # pos_data stores naive local times, the feed carries them the same way
+    return [ {
+        "id": row["id"],
+        "source": row["source"],
+        "content": row["content"],
+        "created_at": row["created_at"].replace(tzinfo=None).isoformat(sep=" ")
+    } for row in rows ]
+
+
+@dataclass
+class FeedEntry():
+    id: int
+    created_at: datetime
+    content: str
+
+
+class StationCache():
+    _size: int
+    _entries: Dict[str, Deque[FeedEntry]]
+    _evicted_until: Dict[str, datetime]
+    _complete_since: datetime
+    _complete_after: Dict[str, int]
+
+    def __init__(self, size: int = 200):
+        self._size = size
+        self._entries = dict()
+        self._evicted_until = dict()
+        self._complete_since = self._now()
+        self._complete_after = dict()
+
+    def _now(self) -> datetime:
+        return datetime.now(FEED_TIMEZONE).replace(tzinfo=None)
+
+    def add_many(self, rows: Iterable[Dict[str, Any]]):
+        for row in rows:
+            entries = self._entries.get(row["source"])
+            if entries is None:
+                entries = self._entries[row["source"]] = deque()
+
+            entry = FeedEntry(
+                id=row["id"],
+                created_at=datetime.fromisoformat(row["created_at"]),
+                content=row["content"])
+
+            if len(entries) == self._size:
+                evicted = entries.popleft()
+                last = self._evicted_until.get(row["source"])
+                if last is None or evicted.created_at > last:
+                    self._evicted_until[row["source"]] = evicted.created_at
+
+            entries.append(entry)
+
+    def reset(self):
+        # Something was lost between the producers and us, only rows from now on are known complete
+        self._complete_since = self._now()
+        for (source, entries) in self._entries.items():
+            if len(entries) > 0:
+                self._complete_after[source] = entries[-1].id
+
+    def recent(self, source: str, created_at: str, after_id: int | None, limit: int) -> List[Dict] | None:
+        try:
+            since = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            return None
+
+        since = since.replace(tzinfo=None)
+
+        # Every row newer than `since` has to be in memory, otherwise the caller asks the DB
+        if since < self._complete_since:
+            return None
+
+        evicted_until = self._evicted_until.get(source)
+        if evicted_until is not None and since <= evicted_until:
+            return None
+
+        records = []
+        for entry in reversed(self._entries.get(source, ())):
+            if entry.created_at < since:
+                continue
+            if after_id is not None and entry.id <= after_id:
+                continue
+
+            records.append({ "Id": entry.id, "TimeStamp": entry.created_at, "Message": entry.content })
+
+        # Like the DB: forward paging gets the oldest rows past the cursor, newest first
+        if after_id is not None:
+            records.sort(key=lambda record: record["Id"])
+            records = records[:limit]
+
+        records.sort(key=lambda record: record["Id"], reverse=True)
+        return records[:limit]
+
+    def after(self, source: str, after_id: int, limit: int) -> List[Dict] | None:
+        entries = self._entries.get(source)
+        if not entries:
+            return None
+
+        # Rows older than the oldest one held, or lost before a reset, are only in the DB
+        if after_id < entries[0].id or after_id < self._complete_after.get(source, 0):
+            return None
+
+        records = [
+            { "Id": entry.id, "TimeStamp": entry.created_at, "Message": entry.content }
+            for entry in entries if entry.id > after_id ]
+
+        records.sort(key=lambda record: record["Id"], reverse=True)
+        return records[-limit:]
+
+
+class StationFeed():
+    _max_pending: int
+    _subscriptions: Dict[str, Set[Subscription]]
+
+    def __init__(self, max_pending: int = 1000):
+        self._max_pending = max_pending
+        self._subscriptions = dict()
+
+    def subscribe(self, sources: Iterable[str]) -> Subscription:
+        subscription = Subscription(self._max_pending)
+        for source in sources:
+            self._subscriptions.setdefault(source, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for source in list(self._subscriptions):
+            subscriptions = self._subscriptions[source]
+            subscriptions.discard(subscription)
+            if len(subscriptions) == 0:
+                del self._subscriptions[source]
+
+    def publish_many(self, rows: Iterable[Dict[str, Any]]):
+        for row in rows:
+            for subscription in self._subscriptions.get(row["source"], ()):
+                subscription.push(row)
@@ -0,0 +1,73 @@
+import asyncio
+from collections import deque
+from typing import Any, Deque, Iterable, List, Set
+
+
+class Subscription():
+    _items: Deque[Any]
+    _event: asyncio.Event
+    _dropped: int
+
+    def __init__(self, max_pending: int):
+        self._items = deque(maxlen=max_pending)
+        self._event = asyncio.Event()
+        self._dropped = 0
+
+    def push(self, item: Any):
+        # A full deque discards its oldest entry, a stalled client only loses lines
+        if len(self._items) == self._items.maxlen:
+            self._dropped += 1
+
+        self._items.append(item)
+        self._event.set()
+
+    async def get(self) -> Any:
+        while len(self._items) == 0:
+            self._event.clear()
+            await self._event.wait()
+
+        return self._items.popleft()
+
+    async def get_many(self, limit: int) -> List[Any]:
+        # Waits for one item, then takes whatever else piled up behind it
+        items = [ await self.get() ]
+        while len(self._items) > 0 and len(items) < limit:
+            items.append(self._items.popleft())
+
+        return items
+
+    def dropped(self) -> int:
+        return self._dropped
+
+
+class Hub():
+    _max_pending: int
+    _replay: Deque[Any]
+    _subscriptions: Set[Subscription]
+
+    def __init__(self, max_pending: int = 1000, replay_size: int = 200):
+        self._max_pending = max_pending
+        self._replay = deque(maxlen=replay_size)
+        self._subscriptions = set()
+
+    def subscribe(self, replay: bool = True) -> Subscription:
+        subscription = Subscription(self._max_pending)
+        if replay:
+            for item in self._replay:
+                subscription.push(item)
+
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    def publish(self, item: Any):
+        self._replay.append(item)
+
+        for subscription in self._subscriptions:
+            subscription.push(item)
+
+    def publish_many(self, items: Iterable[Any]):
+        for item in items:
+            self.publish(item)
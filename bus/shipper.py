@@ -0,0 +1,204 @@
+import time
+import queue
+import atexit
+import logging
+import requests
+import threading
+import logging.handlers
+import multiprocessing as mp
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List
+
+MAX_BACKOFF_IN_SECONDS = 60
+
+
+class Shipper():
+    _type: str
+    _url: str
+    _batch_size: int
+    _flush_interval: float
+    _max_buffer: int
+    _target_queue: mp.Queue
+
+    # Internal
+    _queue: queue.Queue
+    _pending: Deque[Any]
+    _lock: threading.Lock
+    _dropped: int
+    _reported_dropped: int
+    _thread: threading.Thread
+    _running: bool
+
+    def __init__(
+        self,
+        type: str,
+        url: str,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        max_buffer: int = 10000,
+        target_queue: mp.Queue = None
+    ):
+        self._type = type
+        self._url = url
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_buffer = max_buffer
+        self._target_queue = target_queue
+
+        # Internal
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._reported_dropped = 0
+        self._thread = None
+        self._running = False
+
+    def offer(self, item: Any):
+        # Never blocks the producer, a full queue costs an item rather than latency
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.count_dropped(1)
+
+    def offer_many(self, items: Iterable[Any]):
+        for item in items:
+            self.offer(item)
+
+    def dropped(self) -> int:
+        return self._dropped
+
+    def count_dropped(self, count: int):
+        with self._lock:
+            self._dropped += count
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"shipper-{ self._type }", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+    def _collect(self, timeout: float, until_full: bool):
+        deadline = time.monotonic() + timeout
+
+        while not (until_full and len(self._pending) >= self._batch_size):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            # While the web service is unreachable, the oldest items go first
+            if len(self._pending) >= self._max_buffer:
+                self._pending.popleft()
+                self.count_dropped(1)
+
+            self._pending.append(item)
+
+    def _payload(self, items: List[Any], dropped: int) -> Dict:
+        return {
+            "type": self._type,
+            "messages": items,
+            "dropped": dropped
+        }
+
+    def _ship(self, payload: Dict) -> bool:
+        # Services started by run.py share a queue with the web process, standalone ones use HTTP
+        if self._target_queue is not None:
+            try:
+                self._target_queue.put_nowait(payload)
+            except queue.Full:
+                return False
+
+            return True
+
+        try:
+            response = requests.post(self._url, json=payload, timeout=5)
+        except requests.RequestException:
+            return False
+
+        return response.ok
+
+    def _run(self):
+        backoff = 0.0
+        retry_at = 0.0
+
+        while self._running or len(self._pending) > 0 or not self._queue.empty():
+            waiting = retry_at - time.monotonic()
+            if waiting > 0 and self._running:
+                self._collect(min(waiting, self._flush_interval), until_full=False)
+                continue
+
+            self._collect(self._flush_interval, until_full=True)
+            if len(self._pending) == 0:
+                continue
+
+            with self._lock:
+                dropped = self._dropped - self._reported_dropped
+
+            if self._ship(self._payload(list(self._pending)[:self._batch_size], dropped)):
+                sent = min(len(self._pending), self._batch_size)
+                for _ in range(sent):
+                    self._pending.popleft()
+
+                with self._lock:
+                    self._reported_dropped += dropped
+
+                backoff = 0.0
+            elif not self._running:
+                # Shutting down with the web service gone, nothing left to wait for
+                break
+            else:
+                backoff = min(max(backoff * 2, 1.0), MAX_BACKOFF_IN_SECONDS)
+                retry_at = time.monotonic() + backoff
+
+
+class _ShipperHandler(logging.handlers.QueueHandler):
+    _shipper: Shipper
+
+    def __init__(self, shipper: Shipper):
+        logging.handlers.QueueHandler.__init__(self, None)
+        self._shipper = shipper
+
+    def enqueue(self, record: logging.LogRecord):
+        # prepare() has already merged the formatted line into the record
+        self._shipper.offer(record.getMessage())
+
+
+class LogShipper(Shipper):
+    _handler: _ShipperHandler
+
+    def __init__(self, log_type: str, url: str, log_queue: mp.Queue = None, **kwargs):
+        Shipper.__init__(self, log_type, url, target_queue=log_queue, **kwargs)
+        self._handler = _ShipperHandler(self)
+
+    def handler(self) -> logging.Handler:
+        return self._handler
+
+    def _payload(self, items: List[Any], dropped: int) -> Dict:
+        if dropped > 0:
+            items = items + [ f"[log shipper] { dropped } log records dropped" ]
+
+        return Shipper._payload(self, items, dropped)
+
+
+def push_log_url(host: str, port: int) -> str:
+    return f"http://{ host }:{ port }/api/push_log"
+
+
+def push_feed_url(host: str, port: int) -> str:
+    return f"http://{ host }:{ port }/api/push_feed"
@@ -1 +1 @@
-from .conf import Conf
\ No newline at end of file
+from .conf import Conf, ProxyInfo
\ No newline at end of file
@@ -25,6 +25,70 @@ class ProxyInfo():
     reconnect_interval_in_seconds: float
 
 
+@dataclass
+class WriterInfo():
+    max_queue: int
+    batch_size: int
+    flush_interval_ms: float
+    policy: str
+    spill_path: str
+
+
+@dataclass
+class FanoutInfo():
+    client_write_limit: int
+    lag_policy: str
+
+
+@dataclass
+class FramingInfo():
+    mode: str
+    delimiter: bytes
+    idle_timeout_ms: float
+    max_age_ms: float
+    max_frame_size: int
+
+
+@dataclass
+class ReconnectInfo():
+    max_backoff_in_seconds: float
+    connect_timeout_in_seconds: float
+    max_concurrent: int
+    failure_threshold: int
+    open_interval_in_seconds: float
+    jitter: float
+
+
+@dataclass
+class KeepaliveInfo():
+    enabled: bool
+    idle_in_seconds: int
+    interval_in_seconds: int
+    count: int
+    origin_read_timeout_in_seconds: float
+    client_read_timeout_in_seconds: float
+
+
+@dataclass
+class ListenerInfo():
+    mode: str
+    host: str
+    port: int
+
+
+@dataclass
+class BackupInfo():
+    compress: bool
+    pages_per_step: int
+    retention_days: int
+
+
+@dataclass
+class WebInfo():
+    workers: int
+    db_threads: int
+
+
 class Conf():
     _conf: Any
     _servers: List[ServerInfo]
@@ -36,9 +100,20 @@ class Conf():
     _interval_in_seconds: float
     _reconnect_inverval: float
     _smb_enabled: bool
+    _smb_connections: int
+    _full_rescan_every: int
     _agent_host: str
     _agent_port: int
     _proxies: List[ProxyInfo]
+    _writer: WriterInfo
+    _fanout: FanoutInfo
+    _framing: FramingInfo
+    _reconnect: ReconnectInfo
+    _keepalive: KeepaliveInfo
+    _listener: ListenerInfo
+    _backup: BackupInfo
+    _web: WebInfo
+    _proxy_workers: int
 
 
     def __init__(self, filepath: str):
@@ -62,6 +137,8 @@ class Conf():
         self._interval_in_seconds = float(smb["interval_in_seconds"])
         self._reconnect_inverval = float(smb["reconnect_inverval"])
         self._smb_enabled = smb["enabled"]
+        self._smb_connections = int(smb.get("connections", 4))
+        self._full_rescan_every = int(smb.get("full_rescan_every", 12))
 
         if "servers" in self._conf:
             servers = self._conf["servers"]
@@ -92,6 +169,73 @@ class Conf():
                     reconnect_interval_in_seconds=reconnect_inverval
                 ))
 
+        writer = self._conf.get("writer", {})
+        self._writer = WriterInfo(
+            max_queue=int(writer.get("max_queue", 10000)),
+            batch_size=int(writer.get("batch_size", 500)),
+            flush_interval_ms=float(writer.get("flush_interval_ms", 200)),
+            policy=writer.get("policy", "drop_oldest"),
+            spill_path=writer.get("spill_path", "spill/pos_data.jsonl")
+        )
+
+        fanout = self._conf.get("fanout", {})
+        self._fanout = FanoutInfo(
+            client_write_limit=int(fanout.get("client_write_limit", 1024 * 1024)),
+            lag_policy=fanout.get("lag_policy", "coalesce")
+        )
+
+        framing = self._conf.get("framing", {})
+        self._framing = FramingInfo(
+            mode=framing.get("mode", "chunk"),
+            delimiter=framing.get("delimiter", "\r\n").encode(),
+            idle_timeout_ms=float(framing.get("idle_timeout_ms", 100)),
+            max_age_ms=float(framing.get("max_age_ms", 1000)),
+            max_frame_size=int(framing.get("max_frame_size", 1024 * 1024))
+        )
+
+        reconnect = self._conf.get("reconnect", {})
+        self._reconnect = ReconnectInfo(
+            max_backoff_in_seconds=float(reconnect.get("max_backoff_in_seconds", 300)),
+            connect_timeout_in_seconds=float(reconnect.get("connect_timeout_in_seconds", 10)),
+            max_concurrent=int(reconnect.get("max_concurrent", 16)),
+            failure_threshold=int(reconnect.get("failure_threshold", 5)),
+            open_interval_in_seconds=float(reconnect.get("open_interval_in_seconds", 300)),
+            jitter=float(reconnect.get("jitter", 0.2))
+        )
+
+        keepalive = self._conf.get("keepalive", {})
+        self._keepalive = KeepaliveInfo(
+            enabled=bool(keepalive.get("enabled", True)),
+            idle_in_seconds=int(keepalive.get("idle_in_seconds", 60)),
+            interval_in_seconds=int(keepalive.get("interval_in_seconds", 10)),
+            count=int(keepalive.get("count", 5)),
+            origin_read_timeout_in_seconds=float(keepalive.get("origin_read_timeout_in_seconds", 0)),
+            client_read_timeout_in_seconds=float(keepalive.get("client_read_timeout_in_seconds", 0))
+        )
+
+        listener = self._conf.get("listener", {})
+        self._listener = ListenerInfo(
+            mode=listener.get("mode", "per_proxy"),
+            host=listener.get("host", "0.0.0.0"),
+            port=int(listener.get("port", 1000))
+        )
+
+        backup = self._conf.get("backup", {})
+        self._backup = BackupInfo(
+            compress=bool(backup.get("compress", True)),
+            pages_per_step=int(backup.get("pages_per_step", 1024)),
+            retention_days=int(backup.get("retention_days", 7))
+        )
+
+        web = self._conf.get("web", {})
+        self._web = WebInfo(
+            workers=int(web.get("workers", 1)),
+            db_threads=int(web.get("db_threads", 5))
+        )
+
+        supervisor = self._conf.get("supervisor", {})
+        self._proxy_workers = int(supervisor.get("proxy_workers", 1))
+
 
     def get_servers(self) -> List[ServerInfo]:
         return self._servers
@@ -149,5 +293,49 @@ class Conf():
     def get_smb_enabled(self) -> bool:
         return self._smb_enabled
 
+
+    def get_smb_connections(self) -> int:
+        return self._smb_connections
+
+
+    def get_full_rescan_every(self) -> int:
+        return self._full_rescan_every
+
+
+    def get_writer(self) -> WriterInfo:
+        return self._writer
+
+
+    def get_fanout(self) -> FanoutInfo:
+        return self._fanout
+
+
+    def get_framing(self) -> FramingInfo:
+        return self._framing
+
+
+    def get_reconnect(self) -> ReconnectInfo:
+        return self._reconnect
+
+
+    def get_keepalive(self) -> KeepaliveInfo:
+        return self._keepalive
+
+
+    def get_listener(self) -> ListenerInfo:
+        return self._listener
+
+
+    def get_backup(self) -> BackupInfo:
+        return self._backup
+
+
+    def get_web(self) -> WebInfo:
+        return self._web
+
+
+    def get_proxy_workers(self) -> int:
+        return self._proxy_workers
+
     def get_conf_obj(self) -> Any:
         return self._conf
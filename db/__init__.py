@@ -1 +1,4 @@
-from .db_cls import Db
\ No newline at end of file
+from .db_cls import Db
+from .crud import MAX_PAGE_SIZE
+from .writer import DbWriter, WriterStats
+from .shards import ShardManager, ShardWriteError, list_shard_days, shard_path
\ No newline at end of file
@@ -1,43 +1,47 @@
 import pytz
 from . import models
 from datetime import datetime
-from operator import attrgetter
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
+from typing import Any, Dict, List
 
-def save_pos(db: Session, source: str, content: str, location: str, _BPSCreated: str):
-    
+def pos_row(source: str, content: str, location: str, _BPSCreated: str | None) -> Dict[str, Any]:
     if _BPSCreated == None:
-        row = models.PosData(
-            source=source,
-            content=content,
-            location=location,
-            created_at=datetime.now(pytz.timezone('America/Sao_Paulo')))
-
-        db.add(row)
-        db.commit()
+        created_at = datetime.now(pytz.timezone('America/Sao_Paulo'))
     else:
-        row = models.PosData(
-            source=source,
-            content=content,
-            location=location,
-            created_at=datetime.strptime(_BPSCreated, '%Y-%m-%d %H:%M:%S'))
+        created_at = datetime.strptime(_BPSCreated, '%Y-%m-%d %H:%M:%S')
 
-        db.add(row)
-        db.commit()
+    return {
+        "source": source,
+        "content": content,
+        "location": location,
+        "created_at": created_at
+    }
 
-def get_pos(db: Session, source: str, created_at: str) -> None:
-    records = db.query(models.PosData.created_at.label('TimeStamp'), models.PosData.content.label('Message')).filter(models.PosData.source == source).filter(models.PosData.created_at >= created_at).order_by(models.PosData.id.desc()).limit(100).all()
-    return records
+# Upper bound for one page of station history
+MAX_PAGE_SIZE = 1000
 
-def get_samba(db: Session, source: str, created_at: str) -> None:
-    records = db.query(models.PosData.created_at.label('TimeStamp'), models.PosData.content.label('Message')).filter(models.PosData.source == source).filter(models.PosData.created_at >= created_at).order_by(models.PosData.id.desc()).limit(50).all()
-    posData = []
-    
-    for record in records:
-        posData.append(record._mapping)
-    posData.sort(key = attrgetter('TimeStamp'), reverse = False)
+def _query_history(db: Session, source: str, created_at: str, after_id: int | None, before_id: int | None, limit: int):
+    query = db.query(models.PosData.id.label('Id'), models.PosData.created_at.label('TimeStamp'), models.PosData.content.label('Message')).filter(models.PosData.source == source)
 
-    return posData
+    # Resuming from a cursor needs no time bound
+    if created_at is not None:
+        query = query.filter(models.PosData.created_at >= created_at)
+
+    # Keyset pagination, the id of the last row seen is the cursor
+    if before_id is not None:
+        query = query.filter(models.PosData.id < before_id)
+
+    if after_id is not None:
+        records = query.filter(models.PosData.id > after_id).order_by(models.PosData.id.asc()).limit(limit).all()
+        records.reverse()
+        return records
+
+    return query.order_by(models.PosData.id.desc()).limit(limit).all()
+
+def get_pos(db: Session, source: str, created_at: str, after_id: int | None = None, before_id: int | None = None, limit: int = 100) -> None:
+    records = _query_history(db, source, created_at, after_id, before_id, max(1, min(limit, MAX_PAGE_SIZE)))
+    return [ record._mapping for record in records ]
 
 def save_user(db: Session, username: str, email: str, hashed_password: str, disabled: bool = True):
     row = models.UserData(
@@ -53,4 +57,23 @@ def save_user(db: Session, username: str, email: str, hashed_password: str, disa
 
 def get_user(db: Session, email: str):
     db_user = db.query(models.UserData).filter(models.UserData.email == email).first()
-    return db_user
\ No newline at end of file
+    return db_user
+
+# Keeps the bound parameters of one statement under SQLite's variable limit
+INSERT_CHUNK_SIZE = 200
+
+def save_pos_many(db: Session, rows: List[Dict[str, Any]]):
+    ids = []
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + INSERT_CHUNK_SIZE]
+        result = db.execute(insert(models.PosData).values(chunk))
+
+        # One statement gets consecutive AUTOINCREMENT ids, the last one is reported back
+        last_id = result.lastrowid
+        ids += range(last_id - len(chunk) + 1, last_id + 1)
+
+    db.commit()
+
+    # A rolled back batch must not carry ids, AUTOINCREMENT hands them out again
+    for (row, id) in zip(rows, ids):
+        row["id"] = id
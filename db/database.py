@@ -1,13 +1,77 @@
-from sqlalchemy import create_engine
+import threading
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///./collection.sqlite3"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-)
+# How long a connection waits on a lock held by another process before failing
+BUSY_TIMEOUT_IN_SECONDS = 10
+
+POOL_SIZE = 5
+
+
+def create_sqlite_engine(url: str, read_only: bool):
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=POOL_SIZE,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": BUSY_TIMEOUT_IN_SECONDS
+        }
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets the web API read while samba/proxy are writing
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={ BUSY_TIMEOUT_IN_SECONDS * 1000 }")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    return engine
+
+
+# One engine (and pool) of each kind per process
+engine = create_sqlite_engine(SQLALCHEMY_DATABASE_URL, read_only=False)
+read_engine = create_sqlite_engine(SQLALCHEMY_DATABASE_URL, read_only=True)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Thread-local sessions, released after every unit of work
+ScopedSession = scoped_session(SessionLocal)
+ReadScopedSession = scoped_session(ReadSessionLocal)
+
+Base = declarative_base()
+
+_schema_lock = threading.Lock()
+_schema_created = False
+
+
+def create_schema():
+    global _schema_created
+
+    with _schema_lock:
+        if _schema_created:
+            return
+
+        Base.metadata.create_all(bind=engine)
+        _migrate()
+        _schema_created = True
+
+
+def _migrate():
+    # create_all() skips existing tables, so indexes added later are created here
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
-Base = declarative_base()
\ No newline at end of file
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_pos_data_source"))
@@ -1,26 +1,49 @@
-from typing import Any
-from .database import engine, SessionLocal, Base
-from .crud import save_pos, get_pos, get_samba, save_user, get_user
+from operator import itemgetter
+from typing import Any, Dict
+from contextlib import contextmanager
+from sqlalchemy.orm import scoped_session
+from .database import ScopedSession, ReadScopedSession, create_schema
+from .crud import pos_row, save_user, get_user, MAX_PAGE_SIZE
+from .shards import ShardManager
 
 
 class Db():
-    _db: Any
+    _sessions: scoped_session
+    _shards: ShardManager
+    _read_only: bool
 
-    def __init__(self):
-        Base.metadata.create_all(bind=engine)
-        self._db = SessionLocal()
+    def __init__(self, read_only: bool = False):
+        create_schema()
+        self._read_only = read_only
+        self._sessions = ReadScopedSession if read_only else ScopedSession
+        self._shards = ShardManager(read_only)
 
-    def save_pos(self, source: str, content: str, location: str, _BPSCreated: str = None):
-        save_pos(self._db, source, content, location, _BPSCreated)
+    @contextmanager
+    def _session(self):
+        db = self._sessions()
+        try:
+            yield db
+        finally:
+            # Hands the connection back to the pool
+            self._sessions.remove()
 
-    def get_pos(self, source: str, created_at: str):
-        return get_pos(self._db, source, created_at)
+    def save_pos(self, source: str, content: str, location: str, _BPSCreated: str = None) -> Dict[str, Any]:
+        row = pos_row(source, content, location, _BPSCreated)
+        self._shards.save_pos_many([ row ])
 
-    def get_samba(self, source: str, created_at: str):
-        return get_samba(self._db, source, created_at)
+        return row
+
+    def get_pos(self, source: str, created_at: str, after_id: int | None = None, before_id: int | None = None, limit: int = 100):
+        return self._shards.history(source, created_at, after_id, before_id, max(1, min(limit, MAX_PAGE_SIZE)))
+
+    def get_samba(self, source: str, created_at: str, after_id: int | None = None, before_id: int | None = None, limit: int = 50):
+        records = self._shards.history(source, created_at, after_id, before_id, max(1, min(limit, MAX_PAGE_SIZE)))
+        return sorted(records, key=itemgetter('TimeStamp'))
     
     def save_user(self, username: str, email: str, hashed_password: str, disabled: bool = True):
-        return save_user(self._db, username, email, hashed_password, disabled)
+        with self._session() as db:
+            return save_user(db, username, email, hashed_password, disabled)
     
     def get_user(self, email: str):
-        return get_user(self._db, email)
\ No newline at end of file
+        with self._session() as db:
+            return get_user(db, email)
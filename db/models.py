@@ -1,15 +1,22 @@
 from .database import Base
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Index
 
 class PosData(Base):
     __tablename__ = "pos_data"
 
     id = Column(Integer, primary_key=True, index=True)
-    source = Column(String, index=True)
+    source = Column(String)
     content = Column(String)
     location = Column(String)
     created_at = Column(DateTime(timezone=True), index=True)
 
+    # Serves the per-station history queries, also replaces the former single column index on source.
+    # AUTOINCREMENT keeps the per-day id ranges of the shards from being reused.
+    __table_args__ = (
+        Index("ix_pos_data_source_created_at_id", "source", "created_at", "id"),
+        { "sqlite_autoincrement": True },
+    )
+
 class UserData(Base):
     __tablename__ = "users"
 
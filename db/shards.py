@@ -0,0 +1,176 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from . import models
+from .crud import get_pos, save_pos_many
+from .database import create_sqlite_engine
+
+SHARD_DIR = "data"
+SHARD_FILE_RE = re.compile(r'^pos_data_(\d{8})\.sqlite3$')
+
+# Ids of a shard start at day.toordinal() * ID_SPAN, so they grow across days and name their shard.
+# Even year 9999 stays under 2 ** 53, the dashboard reads ids as JavaScript numbers.
+ID_SPAN = 10 ** 9
+
+# Shard engines kept open per process, older days are opened again on demand
+MAX_OPEN_SHARDS = 8
+
+
+def shard_path(day: date) -> str:
+    return os.path.join(SHARD_DIR, f"pos_data_{ day.strftime('%Y%m%d') }.sqlite3")
+
+
+def shard_base(day: date) -> int:
+    return day.toordinal() * ID_SPAN
+
+
+def shard_day_of_id(id: int) -> date | None:
+    # Cursors that no shard hands out (0, ids of collection.sqlite3) come before the first shard
+    try:
+        return date.fromordinal(id // ID_SPAN)
+    except (OverflowError, ValueError):
+        return None
+
+
+def list_shard_days() -> List[date]:
+    if not os.path.isdir(SHARD_DIR):
+        return []
+
+    days = []
+    for name in os.listdir(SHARD_DIR):
+        match = SHARD_FILE_RE.match(name)
+        if match:
+            days.append(datetime.strptime(match.group(1), "%Y%m%d").date())
+
+    return sorted(days)
+
+
+def _parse_from(created_at: str) -> date | None:
+    try:
+        return datetime.fromisoformat(created_at).date()
+    except (TypeError, ValueError):
+        return None
+
+
+class ShardWriteError(Exception):
+    # Days are committed one shard at a time, the ones before the failing day stay written
+    rows: List[Dict[str, Any]]
+
+    def __init__(self, day: date, rows: List[Dict[str, Any]]):
+        super().__init__(f"Failed to write the { day.isoformat() } shard")
+        self.rows = rows
+
+
+class ShardManager():
+    _read_only: bool
+    _engines: "OrderedDict[date, Engine]"
+    _sessions: Dict[date, sessionmaker]
+    _lock: threading.Lock
+
+    def __init__(self, read_only: bool = False):
+        self._read_only = read_only
+        self._engines = OrderedDict()
+        self._sessions = dict()
+        self._lock = threading.Lock()
+
+    def _create_shard(self, day: date, engine: Engine):
+        base = shard_base(day)
+
+        try:
+            models.PosData.__table__.create(bind=engine, checkfirst=True)
+        except OperationalError:
+            # Another process created it first
+            pass
+
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT 'pos_data', :base "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'pos_data')"), { "base": base })
+
+    def _session_for(self, day: date, create: bool) -> sessionmaker | None:
+        with self._lock:
+            if day in self._engines:
+                self._engines.move_to_end(day)
+                return self._sessions[day]
+
+            path = shard_path(day)
+            if not os.path.exists(path):
+                if not create:
+                    return None
+
+                os.makedirs(SHARD_DIR, exist_ok=True)
+
+            engine = create_sqlite_engine(f"sqlite:///{ path }", self._read_only)
+            if create:
+                self._create_shard(day, engine)
+
+            self._engines[day] = engine
+            self._sessions[day] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+            while len(self._engines) > MAX_OPEN_SHARDS:
+                (old_day, old_engine) = self._engines.popitem(last=False)
+                del self._sessions[old_day]
+                old_engine.dispose()
+
+            return self._sessions[day]
+
+    def save_pos_many(self, rows: Iterable[Dict[str, Any]]):
+        # Not atomic across days, a failure raises ShardWriteError with the rows left unsaved
+        rows_by_day: Dict[date, List[Dict[str, Any]]] = dict()
+        for row in rows:
+            rows_by_day.setdefault(row["created_at"].date(), []).append(row)
+
+        days = list(rows_by_day.items())
+        for (i, (day, day_rows)) in enumerate(days):
+            try:
+                with self._session_for(day, create=True)() as db:
+                    save_pos_many(db, day_rows)
+            except Exception as e:
+                raise ShardWriteError(day, [ row for (_, rest) in days[i:] for row in rest ]) from e
+
+    def history(self, source: str, created_at: str, after_id: int | None, before_id: int | None, limit: int) -> List[Any]:
+        days = list_shard_days()
+
+        # Only shards that can hold rows after `From` and inside the cursor window are opened
+        from_day = _parse_from(created_at)
+        if from_day is not None:
+            days = [ day for day in days if day >= from_day ]
+        if before_id is not None:
+            before_day = shard_day_of_id(before_id)
+            if before_day is None:
+                return []
+            days = [ day for day in days if day <= before_day ]
+        if after_id is not None:
+            after_day = shard_day_of_id(after_id)
+            if after_day is None:
+                after_id = 0
+            else:
+                days = [ day for day in days if day >= after_day ]
+
+        records = []
+
+        # Forward paging walks from the cursor up, otherwise from the newest shard down
+        if after_id is None:
+            days.reverse()
+
+        for day in days:
+            sessions = self._session_for(day, create=False)
+            if sessions is None:
+                continue
+
+            with sessions() as db:
+                records += get_pos(db, source, created_at, after_id, before_id, limit - len(records))
+
+            if len(records) >= limit:
+                break
+
+        records.sort(key=lambda record: record["Id"], reverse=True)
+        return records
@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List
+
+from .crud import pos_row
+from .shards import ShardManager, ShardWriteError
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_BLOCK = "block"
+POLICY_SPILL = "spill"
+
+STATS_LOG_INTERVAL_IN_SECONDS = 60
+
+# After a failed write the spill file is left alone this long, doubling up to the max
+REPLAY_BACKOFF_MIN_IN_SECONDS = 5
+REPLAY_BACKOFF_MAX_IN_SECONDS = 300
+
+
+@dataclass
+class WriterStats():
+    queue_depth: int
+    enqueued: int
+    written: int
+    dropped: int
+    spilled: int
+    flushes: int
+    last_flush_ms: float
+    max_flush_ms: float
+
+
+class DbWriter():
+    _max_queue: int
+    _batch_size: int
+    _flush_interval: float
+    _policy: str
+    _spill_path: str
+    _shards: ShardManager
+    _on_saved: Callable[[List[Dict[str, Any]]], None]
+
+    # Internal
+    _queue: Deque[Dict[str, Any]]
+    _overflow: Deque[Dict[str, Any]]
+    _cond: threading.Condition
+    _thread: threading.Thread
+    _running: bool
+    _stats: WriterStats
+    _last_stats_log: float
+    _replay_backoff: float
+    _replay_at: float
+    _warned_block: bool
+
+    def __init__(
+        self,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval_ms: float = 200,
+        policy: str = POLICY_DROP_OLDEST,
+        spill_path: str = "spill/pos_data.jsonl",
+        on_saved: Callable[[List[Dict[str, Any]]], None] = None
+    ) -> None:
+        if policy not in (POLICY_DROP_OLDEST, POLICY_BLOCK, POLICY_SPILL):
+            raise Exception(f"Unknown writer policy '{ policy }'")
+
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval_ms / 1000
+        self._policy = policy
+        self._spill_path = spill_path
+        self._shards = ShardManager()
+        self._on_saved = on_saved
+
+        # Internal
+        self._queue = deque()
+        self._overflow = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stats = WriterStats(0, 0, 0, 0, 0, 0, 0.0, 0.0)
+        self._last_stats_log = time.monotonic()
+        self._replay_backoff = 0.0
+        self._replay_at = 0.0
+        self._warned_block = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        self._thread.join()
+        self._thread = None
+
+    def save_pos(self, source: str, content: str, location: str, _BPSCreated: str = None):
+        self.put(pos_row(source, content, location, _BPSCreated))
+
+    def put(self, row: Dict[str, Any]):
+        # The block policy is for producer threads. Blocking an event loop would stall every
+        # connection on it, so producers running on one get drop_oldest instead.
+        with self._cond:
+            if len(self._queue) >= self._max_queue:
+                if self._policy == POLICY_BLOCK and not self._in_event_loop():
+                    while self._running and len(self._queue) >= self._max_queue:
+                        self._cond.wait()
+                elif self._policy == POLICY_SPILL:
+                    # The writer thread appends it to the spill file, producers never touch the disk
+                    if len(self._overflow) >= self._max_queue:
+                        self._overflow.popleft()
+                        self._stats.dropped += 1
+
+                    self._overflow.append(row)
+                    self._cond.notify_all()
+                    return
+                else:
+                    self._queue.popleft()
+                    self._stats.dropped += 1
+
+            self._queue.append(row)
+            self._stats.enqueued += 1
+
+            if len(self._queue) >= self._batch_size:
+                self._cond.notify_all()
+
+    def _in_event_loop(self) -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        if not self._warned_block:
+            self._warned_block = True
+            logging.warning("DB writer queue is full, the block policy drops the oldest rows on an event loop")
+
+        return True
+
+    def stats(self) -> WriterStats:
+        with self._cond:
+            self._stats.queue_depth = len(self._queue)
+            return WriterStats(**self._stats.__dict__)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            deadline = time.monotonic() + self._flush_interval
+            while self._running and len(self._queue) < self._batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                self._cond.wait(remaining)
+
+            count = min(len(self._queue), self._batch_size)
+            rows = [ self._queue.popleft() for _ in range(count) ]
+
+            # Wake up producers blocked on a full queue
+            if count > 0:
+                self._cond.notify_all()
+
+            return rows
+
+    def _run(self):
+        while True:
+            try:
+                rows = self._take_batch()
+                self._spill_overflow()
+
+                if len(rows) > 0:
+                    self._flush(rows)
+                elif not self._running:
+                    break
+                else:
+                    self._replay_spill()
+
+                self._log_stats()
+            except:
+                # Nothing may end this thread, the queue would fill up with no one to write it
+                logging.exception("DB writer pass failed")
+                if not self._running:
+                    break
+
+    def _save(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Returns the rows that were not committed
+        started = time.perf_counter()
+
+        try:
+            self._shards.save_pos_many(rows)
+            failed = []
+        except ShardWriteError as e:
+            logging.exception(f"Failed to write { len(e.rows) } of { len(rows) } rows")
+            failed = e.rows
+        except:
+            logging.exception(f"Failed to write { len(rows) } rows")
+            failed = rows
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if len(failed) < len(rows):
+            # Only committed rows carry an id, the days written before a failure count as saved
+            saved = rows if len(failed) == 0 else [ row for row in rows if "id" in row ]
+
+            if self._on_saved is not None:
+                try:
+                    self._on_saved(saved)
+                except:
+                    logging.exception("on_saved handler failed")
+
+            with self._cond:
+                self._stats.written += len(saved)
+                self._stats.flushes += 1
+                self._stats.last_flush_ms = elapsed_ms
+                self._stats.max_flush_ms = max(self._stats.max_flush_ms, elapsed_ms)
+
+        if len(failed) > 0:
+            # The DB is likely down, replaying the spill file right away would only fail again
+            self._back_off()
+        else:
+            self._replay_backoff = 0.0
+
+        return failed
+
+    def _flush(self, rows: List[Dict[str, Any]]) -> bool:
+        failed = self._save(rows)
+        if len(failed) == 0:
+            return True
+
+        if self._policy == POLICY_SPILL:
+            self._spill(failed)
+        else:
+            with self._cond:
+                self._stats.dropped += len(failed)
+
+        return False
+
+    def _back_off(self):
+        self._replay_backoff = min(max(self._replay_backoff * 2, REPLAY_BACKOFF_MIN_IN_SECONDS), REPLAY_BACKOFF_MAX_IN_SECONDS)
+        self._replay_at = time.monotonic() + self._replay_backoff
+
+    def _spill_overflow(self):
+        with self._cond:
+            if len(self._overflow) == 0:
+                return
+
+            rows = list(self._overflow)
+            self._overflow.clear()
+
+        self._spill(rows)
+
+    def _spill(self, rows: List[Dict[str, Any]]):
+        # Only the writer thread writes the spill file, the lock is held for the stats alone
+        try:
+            self._write_rows(self._spill_path, rows, "at")
+        except OSError:
+            logging.exception(f"Failed to spill { len(rows) } rows, dropping them")
+            with self._cond:
+                self._stats.dropped += len(rows)
+            return
+
+        with self._cond:
+            self._stats.spilled += len(rows)
+
+    def _write_rows(self, path: str, rows: List[Dict[str, Any]], mode: str):
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        with open(path, mode) as fp:
+            for row in rows:
+                # Spilled rows get new ids when they are replayed
+                row = { key: value for (key, value) in row.items() if key != "id" }
+                fp.write(json.dumps({ **row, "created_at": row["created_at"].isoformat() }) + "\n")
+
+    def _replay_spill(self):
+        if time.monotonic() < self._replay_at:
+            return
+
+        # A replay file left by an earlier attempt goes first, new spills wait in the spill file
+        replay_path = f"{ self._spill_path }.replay"
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self._spill_path):
+                return
+
+            os.replace(self._spill_path, replay_path)
+
+        try:
+            rows = []
+            with open(replay_path, "rt") as fp:
+                for line in fp:
+                    row = json.loads(line)
+                    row.pop("id", None)
+                    row["created_at"] = datetime.fromisoformat(row["created_at"])
+                    rows.append(row)
+
+            logging.info(f"Replaying { len(rows) } spilled rows")
+            for i in range(0, len(rows), self._batch_size):
+                failed = self._save(rows[i:i + self._batch_size])
+                if len(failed) == 0:
+                    continue
+
+                # The replay file keeps the failed rows and the untried ones, written rows leave it
+                temp_path = f"{ replay_path }.tmp"
+                self._write_rows(temp_path, failed + rows[i + self._batch_size:], "wt")
+                os.replace(temp_path, replay_path)
+
+                logging.warning(f"Replay stopped, retrying in { self._replay_backoff } seconds")
+                return
+        except:
+            logging.exception(f"Failed to replay { replay_path }, it is kept for the next try")
+            self._back_off()
+            return
+
+        os.remove(replay_path)
+
+    def _log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log < STATS_LOG_INTERVAL_IN_SECONDS:
+            return
+
+        self._last_stats_log = now
+        stats = self.stats()
+        logging.info(
+            f"DB writer: depth={ stats.queue_depth } written={ stats.written } dropped={ stats.dropped } "
+            f"spilled={ stats.spilled } flushes={ stats.flushes } last_flush={ stats.last_flush_ms:.1f}ms "
+            f"max_flush={ stats.max_flush_ms:.1f}ms"
+        )
@@ -8,6 +8,9 @@ New-Item -ItemType Directory -Path $TARGETDIR
 New-Item -ItemType Directory -Path "$TARGETDIR\conf"
 New-Item -ItemType Directory -Path "$TARGETDIR\db"
 New-Item -ItemType Directory -Path "$TARGETDIR\kvdb"
+New-Item -ItemType Directory -Path "$TARGETDIR\bus"
+New-Item -ItemType Directory -Path "$TARGETDIR\assets"
+New-Item -ItemType Directory -Path "$TARGETDIR\supervisor"
 New-Item -ItemType Directory -Path "$TARGETDIR\proxy"
 New-Item -ItemType Directory -Path "$TARGETDIR\samba"
 New-Item -ItemType Directory -Path "$TARGETDIR\server"
@@ -25,6 +28,9 @@ Copy-Item -Path "..\conf.yaml" -Destination $TARGETDIR\conf.yaml
 Copy-Item -Path "..\conf\*.py" -Destination "$TARGETDIR\conf"
 Copy-Item -Path "..\db\*.py" -Destination "$TARGETDIR\db"
 Copy-Item -Path "..\kvdb\*.py" -Destination "$TARGETDIR\kvdb"
+Copy-Item -Path "..\bus\*.py" -Destination "$TARGETDIR\bus"
+Copy-Item -Path "..\assets\*.py" -Destination "$TARGETDIR\assets"
+Copy-Item -Path "..\supervisor\*.py" -Destination "$TARGETDIR\supervisor"
 Copy-Item -Path "..\samba\*.py" -Destination "$TARGETDIR\samba"
 Copy-Item -Path "..\server\*.py" -Destination "$TARGETDIR\server"
 Copy-Item -Path "..\config\*" -Destination "$TARGETDIR\config" -Recurse
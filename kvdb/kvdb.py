@@ -1,4 +1,6 @@
-from typing import Dict
+import sqlite3
+import threading
+from typing import Dict, Iterable
 from datetime import datetime
 from dataclasses import dataclass
 
@@ -7,19 +9,56 @@ from dataclasses import dataclass
 class DBValue():
     last_processed: datetime
     last_write: datetime
+    size: int = 0
+    hash: str = ""
 
 
 class KVDB():
     _kv: Dict[str, DBValue]
+    _conn: sqlite3.Connection
+    _lock: threading.Lock
 
-    def __init__(self):
+    def __init__(self, path: str = "processed.sqlite3"):
         self._kv = dict()
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_files ("
+            "path TEXT PRIMARY KEY, "
+            "last_processed TEXT NOT NULL, "
+            "last_write TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "hash TEXT NOT NULL)")
+        self._conn.commit()
+
+        # The whole index is small enough to be kept hot, lookups never touch the disk
+        for (path, last_processed, last_write, size, hash) in self._conn.execute("SELECT * FROM processed_files"):
+            self._kv[path] = DBValue(
+                last_processed=datetime.fromisoformat(last_processed),
+                last_write=datetime.fromisoformat(last_write),
+                size=size,
+                hash=hash)
 
     def set(self, key: str, val: DBValue):
-        self._kv[key] = val
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO processed_files VALUES (?, ?, ?, ?, ?)",
+                (key, val.last_processed.isoformat(), val.last_write.isoformat(), val.size, val.hash))
+            self._conn.commit()
+
+            self._kv[key] = val
 
     def get(self, key: str) -> DBValue | None:
         try:
             return self._kv[key]
         except:
-            return None
\ No newline at end of file
+            return None
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, DBValue]:
+        return { key: self._kv[key] for key in keys if key in self._kv }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
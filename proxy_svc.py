@@ -1,47 +1,139 @@
+import os
 import sys
 import json
+import time
+import queue
 import asyncio
 import logging
-from db import Db  
-from conf import Conf
+import functools
+from db import DbWriter
+from conf import Conf, ProxyInfo
 import logging.handlers
-from typing import Dict
-from tcp import TCPProxy
+from typing import Dict, Tuple
+from dataclasses import asdict
+from tcp import TCPProxy, MultiplexServer, ReconnectScheduler, KeepaliveOptions, IdleWheel, create_framer
 from watcher import Watcher
+from datetime import datetime
 import multiprocessing as mp
-from logging import StreamHandler
+from bus import Bus, Shipper, LogShipper, push_log_url, push_feed_url, to_feed_rows
+from supervisor import Supervisor, shard_of, STOP_COMMAND
 
-class WebsocketHandler(StreamHandler):
-    _skip: bool
+CONF_PATH = "conf.yaml"
 
-    def __init__(self):
-        self._skip = False
-        StreamHandler.__init__(self)
+# conf.yaml is checked this often for edits made through the web UI
+CONF_POLL_IN_SECONDS = 2.0
 
-    def emit(self, record):
-        if self._skip:
-            return
+RELOAD_COMMAND = { "TYPE": "reload" }
 
-        msg = self.format(record)
+# Workers report to the supervisor this often
+STATUS_INTERVAL_IN_SECONDS = 10
+
+# Every proxy on its own port, all of them behind one port, or both
+LISTENER_PER_PROXY = "per_proxy"
+LISTENER_SHARED = "shared"
+LISTENER_BOTH = "both"
+
+
+def proxy_infos(conf: Conf) -> Dict[str, ProxyInfo]:
+    # The first entry wins when a name is listed twice
+    infos = dict()
+    for proxy in conf._proxies:
+        infos.setdefault(proxy.name, proxy)
+
+    return infos
+
+
+def split_origin(origin: str) -> Tuple[str, int]:
+    (host, port) = origin.split(":")
+    return (host, int(port))
 
-        try:
-            pass
-        except:
-            self._skip = True
 
 class App():
     _conf: Conf
-    _sqlite_db: Db
+    _writer: DbWriter
+    _feed: Shipper
     _queue: mp.Queue
     _watcher: Watcher
     _proxy_by_name: Dict[str, TCPProxy]
+    _reconnect: ReconnectScheduler
+    _keepalive: KeepaliveOptions
+    _idle_wheel: IdleWheel
+    _shared_listener: MultiplexServer
+    _listen_per_proxy: bool
+    _commands: asyncio.Queue
+    _reader: Bus
+    _watcher_handle: asyncio.TimerHandle
+    _conf_mtime: float
+    _conf_handle: asyncio.TimerHandle
+    _shard: int
+    _shard_count: int
+    _status: mp.Queue
+    _status_handle: asyncio.TimerHandle
+    _stopping: bool
+
+    def __init__(self, queue: mp.Queue, shard: int = 0, shard_count: int = 1, status: mp.Queue = None):
+        self._shard = shard
+        self._shard_count = shard_count
+        self._status = status
+        self._conf = Conf(CONF_PATH)
+        self._conf_mtime = self._read_conf_mtime()
+        # Saved rows go to the web process, which answers recent history from memory
+        self._feed = Shipper("feed", push_feed_url(self._conf.get_agent_host(), self._conf.get_agent_port()))
 
-    def __init__(self, queue: mp.Queue):
-        self._conf = Conf("conf.yaml")
-        self._sqlite_db = Db()
+        writer = self._conf.get_writer()
+        spill_path = writer.spill_path
+        if shard_count > 1:
+            # Every worker replays only its own spill file
+            (root, ext) = os.path.splitext(spill_path)
+            spill_path = f"{ root }.{ shard }{ ext }"
+
+        self._writer = DbWriter(
+            max_queue=writer.max_queue,
+            batch_size=writer.batch_size,
+            flush_interval_ms=writer.flush_interval_ms,
+            policy=writer.policy,
+            spill_path=spill_path,
+            on_saved=lambda rows: self._feed.offer_many(to_feed_rows(rows))
+        )
         self._queue = queue
         self._proxy_by_name = dict()
-        self._watcher = Watcher()
+        reconnect = self._conf.get_reconnect()
+        self._reconnect = ReconnectScheduler(
+            max_backoff=reconnect.max_backoff_in_seconds,
+            connect_timeout=reconnect.connect_timeout_in_seconds,
+            max_concurrent=reconnect.max_concurrent,
+            failure_threshold=reconnect.failure_threshold,
+            open_interval=reconnect.open_interval_in_seconds,
+            jitter=reconnect.jitter)
+        keepalive = self._conf.get_keepalive()
+        self._keepalive = None
+        if keepalive.enabled:
+            self._keepalive = KeepaliveOptions(
+                idle=keepalive.idle_in_seconds,
+                interval=keepalive.interval_in_seconds,
+                count=keepalive.count)
+        # Read-idle timeouts of every connection in this process share one timer
+        self._idle_wheel = IdleWheel()
+        self._shared_listener = None
+        self._listen_per_proxy = True
+        backup = self._conf.get_backup()
+        self._watcher = Watcher(
+            compress=backup.compress,
+            pages_per_step=backup.pages_per_step,
+            retention_days=backup.retention_days)
+        self._commands = asyncio.Queue()
+        # Discovery messages are read off the mp.Queue on a thread and queued on the loop
+        self._reader = Bus("commands", self._commands.put_nowait)
+        self._watcher_handle = None
+        self._conf_handle = None
+        self._status_handle = None
+        self._stopping = False
+
+    def _proxy_infos(self, conf: Conf) -> Dict[str, ProxyInfo]:
+        # Under the supervisor each worker owns the proxies hashed to its shard
+        return {
+            name: proxy for (name, proxy) in proxy_infos(conf).items()
+            if shard_of(name, self._shard_count) == self._shard }
 
     async def _start_proxies(self):
         logging.info("Starting proxies ...")
@@ -50,73 +142,277 @@ class App():
             logging.warning("Looks like proxies have started?")
 
         tasks = []
-        for proxy in self._conf._proxies:
+        for proxy in self._proxy_infos(self._conf).values():
             if proxy.name in self._proxy_by_name:
                 continue
 
-            (host, port) = proxy.origin.split(":")
+            tasks.append(self._create_proxy(proxy).start())
+
+        await asyncio.gather(*tasks)
+
+    def _create_proxy(self, proxy: ProxyInfo) -> TCPProxy:
+        fanout = self._conf.get_fanout()
+        framing = self._conf.get_framing()
+        keepalive = self._conf.get_keepalive()
+        (host, port) = split_origin(proxy.origin)
+
+        inst = TCPProxy(
+            writer=self._writer,
+            name=proxy.name,
+            location=proxy.location,
+            listen_host="0.0.0.0",
+            listen_port=proxy.port,
+            origin_host=host,
+            origin_port=port,
+            auto_connect=proxy.auto_connect,
+            reconnect_interval=proxy.reconnect_interval_in_seconds,
+            client_write_limit=fanout.client_write_limit,
+            lag_policy=fanout.lag_policy,
+            framer_factory=functools.partial(create_framer, framing.mode, framing.delimiter, framing.max_frame_size),
+            frame_idle_timeout=framing.idle_timeout_ms / 1000,
+            frame_max_age=framing.max_age_ms / 1000,
+            reconnect_scheduler=self._reconnect,
+            keepalive=self._keepalive,
+            idle_wheel=self._idle_wheel,
+            origin_read_timeout=keepalive.origin_read_timeout_in_seconds,
+            client_read_timeout=keepalive.client_read_timeout_in_seconds,
+            listen=self._listen_per_proxy,
+            shared_listener=self._shared_listener
+        )
+        self._proxy_by_name[proxy.name] = inst
+
+        return inst
+
+    def _read_conf_mtime(self) -> float:
+        try:
+            return os.stat(CONF_PATH).st_mtime
+        except OSError:
+            return None
 
-            inst = TCPProxy(
-                db=self._sqlite_db,
-                name=proxy.name,
-                location=proxy.location,
-                listen_host="0.0.0.0",
-                listen_port=proxy.port,
+    def _arm_conf_check(self):
+        loop = asyncio.get_running_loop()
+        self._conf_handle = loop.call_later(CONF_POLL_IN_SECONDS, self._on_conf_check)
+
+    def _on_conf_check(self):
+        mtime = self._read_conf_mtime()
+        if mtime is not None and mtime != self._conf_mtime:
+            self._conf_mtime = mtime
+            # Queued like a discovery message, so a reload never overlaps with one
+            self._commands.put_nowait(RELOAD_COMMAND)
+
+        if not self._stopping:
+            self._arm_conf_check()
+
+    async def _reload_conf(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            conf = await loop.run_in_executor(None, Conf, CONF_PATH)
+        except:
+            logging.exception("Can't reload conf.yaml, the running proxies are kept")
+            return
+
+        old = self._proxy_infos(self._conf)
+        new = self._proxy_infos(conf)
+        self._conf = conf
+
+        # A new listen port needs a new listener, anything else is changed in place
+        removed = [ name for name in old if name not in new ]
+        added = [ name for name in new if name not in old ]
+        moved = [ name for name in new if name in old and new[name].port != old[name].port ]
+        changed = [ name for name in new if name in old and new[name] != old[name] and name not in moved ]
+
+        logging.info(
+            f"conf.yaml changed: { len(added) } proxies added, { len(removed) } removed, "
+            f"{ len(moved) } moved to a new port, { len(changed) } changed in place")
+
+        stopping = [ self._proxy_by_name.pop(name) for name in removed + moved if name in self._proxy_by_name ]
+        await asyncio.gather(*[ proxy.stop() for proxy in stopping ])
+
+        for name in changed:
+            (host, port) = split_origin(new[name].origin)
+            await self._proxy_by_name[name].retarget(
+                location=new[name].location,
                 origin_host=host,
-                origin_port=int(port),
-                auto_connect=proxy.auto_connect,
-                reconnect_interval=proxy.reconnect_interval_in_seconds
-            )
-            self._proxy_by_name[proxy.name] = inst
+                origin_port=port,
+                auto_connect=new[name].auto_connect,
+                reconnect_interval=new[name].reconnect_interval_in_seconds)
 
-            tasks.append(inst.start())
+        await asyncio.gather(*[ self._create_proxy(new[name]).start() for name in added + moved ])
 
-        await asyncio.gather(*tasks)
+    def _arm_watcher(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            next_run = self._watcher.next_run(datetime.now())
+        except:
+            logging.exception("Can't read the watcher schedule")
+            return
+
+        delay = (next_run - datetime.now()).total_seconds()
+        logging.info(f"Next backup scheduled at { next_run }")
+        self._watcher_handle = loop.call_at(loop.time() + max(delay, 0), self._on_watcher_due)
+
+    def _on_watcher_due(self):
+        # Backup and purge run on a worker thread, the proxies keep forwarding
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self._watcher.run)
+        future.add_done_callback(self._on_watcher_done)
+
+    def _on_watcher_done(self, future: asyncio.Future):
+        try:
+            future.result()
+        except asyncio.CancelledError:
+            return
+        except:
+            logging.exception("Scheduled backup failed")
+
+        if not self._stopping:
+            self._arm_watcher()
+
+    def _arm_status(self):
+        loop = asyncio.get_running_loop()
+        self._status_handle = loop.call_later(STATUS_INTERVAL_IN_SECONDS, self._report_status)
+
+    def _report_status(self):
+        status = {
+            "shard": self._shard,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "proxies": len(self._proxy_by_name),
+            "connected": sum(1 for proxy in self._proxy_by_name.values() if proxy.is_connected()),
+            "writer": asdict(self._writer.stats()),
+            "reconnect": self._reconnect.stats()
+        }
+
+        try:
+            self._status.put_nowait(status)
+        except queue.Full:
+            pass
+
+        if not self._stopping:
+            self._arm_status()
+
+    async def _handle_message(self, msg: Dict):
+        logging.info(f"Got message: { json.dumps(msg) }")
+
+        name = msg["NAME"]
+        ip = msg["IP"]
+        port = int(msg["PORT"])
+        logging.info(f"IP={ ip }, NAME={ name }, PORT={ port }")
+
+        if name not in self._proxy_by_name:
+            logging.warning(f"'{ name }' was not listed in config file, skip")
+            return
+
+        proxy = self._proxy_by_name[name]
+        if proxy.is_connected():
+            logging.info(f"Proxy '{ name }' already in active session, skipping")
+        elif proxy.is_auto_reconnect():
+            logging.info(f"Proxy '{ name }' in auto_connect mode, ignored discovery message")
+        else:
+            await proxy.reset_origin()
+            await proxy.connect_origin()
+
+    async def _start_shared_listener(self):
+        listener = self._conf.get_listener()
+        if listener.mode == LISTENER_PER_PROXY:
+            return
+
+        # Workers own different proxies, a single port can't serve all of them
+        if self._shard_count > 1:
+            logging.error(
+                f"listener.mode '{ listener.mode }' needs supervisor.proxy_workers: 1, "
+                f"keeping a port per proxy")
+            return
+
+        taken = { proxy.port for proxy in proxy_infos(self._conf).values() } | { server.port for server in self._conf.get_servers() }
+        if listener.port in taken:
+            logging.error(f"listener.port { listener.port } is already used in conf.yaml, keeping a port per proxy")
+            return
+
+        fanout = self._conf.get_fanout()
+        keepalive = self._conf.get_keepalive()
+
+        self._shared_listener = MultiplexServer(
+            f"shared { listener.port }",
+            listener.host,
+            listener.port,
+            write_limit=fanout.client_write_limit,
+            lag_policy=fanout.lag_policy,
+            keepalive=self._keepalive,
+            idle_wheel=self._idle_wheel,
+            read_timeout=keepalive.client_read_timeout_in_seconds)
+
+        if not await self._shared_listener.start():
+            self._shared_listener = None
+            return
+
+        self._listen_per_proxy = listener.mode != LISTENER_SHARED
 
     async def run(self):
+        self._feed.start()
+        self._writer.start()
+        await self._start_shared_listener()
         await self._start_proxies()
-  
+
+        # Backups and shard expiry run once, in the first worker
+        if self._shard == 0:
+            self._arm_watcher()
+
+        self._arm_conf_check()
+
+        if self._status is not None:
+            self._report_status()
+
+        self._reader.start(self._queue)
+
+        # Sleeps until a command arrives, the watcher runs from its own timer
         while True:
-            if self._queue is not None:
-                if not self._queue.empty():
-                    try:
-                        msg = self._queue.get_nowait()
-                        logging.info(f"Got message: { json.dumps(msg) }")
-
-                        name = msg["NAME"]
-                        ip = msg["IP"]
-                        port = int(msg["PORT"])
-                        print(msg)
-                        logging.info(f"IP={ ip }, NAME={ name }, PORT={ port }")
-
-                        if name not in self._proxy_by_name:
-                            logging.warning(f"'{ name }' was not listed in config file, skip")
-                            continue
-
-                        proxy = self._proxy_by_name[name]
-                        if proxy.is_connected():
-                            logging.info(f"Proxy '{ name }' already in active session, skipping")
-                        elif proxy.is_auto_reconnect():
-                            logging.info(f"Proxy '{ name }' in auto_connect mode, ignored discovery message")
-                        else:
-                            await proxy.reset_origin()
-                            await proxy.connect_origin()
-                    except:
-                        logging.exception("Handled exception")
-
-            self._watcher.check_schedule()
-            await asyncio.sleep(0.1)
+            msg = await self._commands.get()
+
+            if msg == STOP_COMMAND:
+                logging.info("Stop requested")
+                return
+
+            try:
+                if msg is RELOAD_COMMAND:
+                    await self._reload_conf()
+                    continue
+
+                await self._handle_message(msg)
+            except:
+                logging.exception("Handled exception")
 
     async def shutdown(self):
+        self._stopping = True
+        self._reader.stop()
+
+        if self._watcher_handle is not None:
+            self._watcher_handle.cancel()
+
+        if self._conf_handle is not None:
+            self._conf_handle.cancel()
+
+        if self._status_handle is not None:
+            self._status_handle.cancel()
+
         for _, proxy in self._proxy_by_name.items():
             await proxy.stop()
 
+        if self._shared_listener is not None:
+            await self._shared_listener.stop()
+
+        self._idle_wheel.stop()
+        self._writer.stop()
+        self._feed.stop()
 
-def entry_point(queue: mp.Queue):
+
+def entry_point(queue: mp.Queue, shard: int = 0, shard_count: int = 1, status: mp.Queue = None):
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    app = App(queue)
+    app = App(queue, shard, shard_count, status)
 
     try:
         loop.run_until_complete(app.run())
@@ -132,6 +428,10 @@ def entry_point(queue: mp.Queue):
 
 
 def run_proxy(queue: mp.Queue, log_to_file: bool):
+    conf = Conf("conf.yaml")
+    shipper = LogShipper("proxy", push_log_url(conf.get_agent_host(), conf.get_agent_port()))
+    shipper.start()
+
     if log_to_file:
         logging.basicConfig(
             format="[%(asctime)s] %(message)s",
@@ -141,7 +441,7 @@ def run_proxy(queue: mp.Queue, log_to_file: bool):
                     "logs/proxy_svc.txt",
                     maxBytes=1024 * 1024 * 100,
                     backupCount=10),
-                WebsocketHandler()
+                shipper.handler()
             ]
         )
     else:
@@ -150,11 +450,29 @@ def run_proxy(queue: mp.Queue, log_to_file: bool):
             level=logging.INFO,
             handlers=[
                 logging.StreamHandler(sys.stdout),
-                WebsocketHandler()
+                shipper.handler()
             ]
         )
 
-    entry_point(queue)
+    workers = conf.get_proxy_workers()
+    if workers > 1:
+        Supervisor("proxy", workers, run_proxy_worker, queue).run()
+    else:
+        entry_point(queue)
+
+def run_proxy_worker(index: int, count: int, commands: mp.Queue, status: mp.Queue, log_records: mp.Queue):
+    # Records are formatted and shipped by the supervisor's handlers
+    logging.basicConfig(
+        format=f"[proxy { index }] %(message)s",
+        level=logging.INFO,
+        handlers=[
+            logging.handlers.QueueHandler(log_records)
+        ],
+        # A forked worker inherits the supervisor's handlers, which would keep this a no-op
+        force=True
+    )
+
+    entry_point(commands, index, count, status)
 
 def main():
     run_proxy(None, False)
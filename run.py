@@ -1,4 +1,5 @@
 import multiprocessing as mp
+from bus import LOG_QUEUE_SIZE, FEED_QUEUE_SIZE
 from web import run_web as web_service
 from samba_svc import run_app as samba_service
 # from proxy_svc import run_proxy as proxy_service
@@ -7,11 +8,13 @@ from samba_svc import run_app as samba_service
 def main():
     try:
         queue = mp.Queue(maxsize=100)
+        logs = mp.Queue(maxsize=LOG_QUEUE_SIZE)
+        feed = mp.Queue(maxsize=FEED_QUEUE_SIZE)
 
-        app = mp.Process(target=samba_service, args=(queue, True))
+        app = mp.Process(target=samba_service, args=(queue, True, logs, feed))
         app.start()
 
-        web = mp.Process(target=web_service, args=(queue, True))
+        web = mp.Process(target=web_service, args=(queue, True, False, logs, feed))
         web.start()
 
         # proxy = mp.Process(target=proxy_service, args=(queue, True))
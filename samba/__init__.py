@@ -1 +1,3 @@
-from .samba import Samba
\ No newline at end of file
+from .samba import Samba, FileInfo
+from .scanner import Scanner, ScanStats, ScannedFile
+from .bps import BpsReport, BpsCounter, BpsStreamParser
\ No newline at end of file
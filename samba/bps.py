@@ -0,0 +1,135 @@
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import List
+
+# Finds the serial in documents the parser gave up on before reaching it
+SERIAL_RE = re.compile(b'SerialNumber="(.+?)"', re.MULTILINE | re.DOTALL)
+
+
+@dataclass
+class BpsCounter():
+    denom_id: str
+    value: str
+    number: str
+    total: int
+
+
+@dataclass
+class BpsReport():
+    raw: bytes
+    created: str | None = None
+    serial: str | None = None
+    machine_serial: str | None = None
+    start_time: str | None = None
+    end_time: str | None = None
+    header_card_id: str | None = None
+    deposit_id: str | None = None
+    counters: List[BpsCounter] = field(default_factory=list)
+    error: str | None = None
+
+    def total_amount(self) -> int:
+        return sum(counter.total for counter in self.counters)
+
+    def is_complete(self) -> bool:
+        return None not in (self.created, self.machine_serial, self.start_time, self.end_time, self.header_card_id, self.deposit_id)
+
+    def to_text(self) -> str:
+        # Create text to display xml data
+        lines = [
+            f'BPS Created="{self.created}"',
+            f'Machine SerialNumber="{self.machine_serial}"',
+            f'StartTime="{self.start_time}" EndTime="{self.end_time}"',
+            f'HeaderCardID="{self.header_card_id}" DepositID="{self.deposit_id}"',
+        ]
+        for counter in self.counters:
+            lines.append(f'DenomID="{counter.denom_id}" Value="{counter.value}" Number="{counter.number}" Total="{counter.total}" ')
+
+        lines.append(f'TotalAmount={self.total_amount()}')
+        return "\r\n".join(lines)
+
+
+# File-like sink for SMB downloads, parses the XML while it is being received
+class BpsStreamParser():
+    _buffer: bytearray
+    _parser: ET.XMLPullParser
+    _report: BpsReport
+    _depth: int
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._report = BpsReport(raw=b"")
+        self._depth = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+
+        # A broken document is still downloaded in full, it gets broadcast as is
+        if self._report.error is None:
+            try:
+                self._parser.feed(data)
+                self._drain()
+            except (ET.ParseError, KeyError, ValueError) as e:
+                self._report.error = f"{ type(e).__name__ }: { e }"
+
+        return len(data)
+
+    def _drain(self):
+        report = self._report
+
+        for event, elem in self._parser.read_events():
+            if event == "end":
+                self._depth -= 1
+
+                # Attributes were consumed on "start", keep the partial tree from growing
+                if self._depth > 0:
+                    elem.clear()
+                continue
+
+            self._depth += 1
+            attrib = elem.attrib
+
+            if self._depth == 1:
+                report.created = attrib.get("Created")
+
+            if report.serial is None and "SerialNumber" in attrib:
+                report.serial = attrib["SerialNumber"]
+
+            if elem.tag == "Counter":
+                value = attrib["Value"]
+                number = attrib["Number"]
+                report.counters.append(BpsCounter(
+                    denom_id=attrib["DenomID"],
+                    value=value,
+                    number=number,
+                    total=int(value) * int(number)))
+            elif elem.tag == "Machine" and report.machine_serial is None:
+                report.machine_serial = attrib["SerialNumber"]
+            elif elem.tag == "ParameterSection" and report.start_time is None:
+                report.start_time = attrib["StartTime"]
+                report.end_time = attrib["EndTime"]
+            elif elem.tag == "HeadercardUnit" and report.header_card_id is None:
+                report.header_card_id = attrib["HeaderCardID"]
+                report.deposit_id = attrib["DepositID"]
+
+    def close(self) -> BpsReport:
+        if self._report.error is None:
+            try:
+                self._parser.close()
+                self._drain()
+            except (ET.ParseError, KeyError, ValueError) as e:
+                self._report.error = f"{ type(e).__name__ }: { e }"
+
+        if self._report.error is None and not self._report.is_complete():
+            self._report.error = "Missing Created, Machine, ParameterSection or HeadercardUnit attributes"
+
+        self._report.raw = bytes(self._buffer)
+
+        # A broken document is still broadcast, which needs its serial
+        if self._report.serial is None:
+            match = SERIAL_RE.search(self._report.raw)
+            if match:
+                self._report.serial = match.group(1).decode("utf-8", errors="replace")
+
+        return self._report
@@ -10,6 +10,7 @@ class FileInfo:
     file_name: str
     is_directory: bool
     last_write_time: float
+    file_size: int
 
 class Samba():
     _conn: SMBConnection
@@ -21,7 +22,8 @@ class Samba():
         return FileInfo(
             file_name=inp.filename,
             is_directory=inp.isDirectory,
-            last_write_time=inp.last_write_time
+            last_write_time=inp.last_write_time,
+            file_size=inp.file_size
         )
 
 
@@ -51,6 +53,12 @@ class Samba():
         return self._is_connected
 
 
+    def close(self):
+        if self._is_connected:
+            self._conn.close()
+            self._is_connected = False
+
+
     def listItems(self, service_name: str, path: str) -> List[FileInfo]:
         items: List[SharedFile] = self._conn.listPath(service_name, path)
         return [ self._sharedfile_to_fileinfo(item) for item in items if (item.filename!="." and item.filename!="..") ]
@@ -0,0 +1,200 @@
+import io
+import time
+import queue
+import logging
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, List, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+
+from .samba import Samba, FileInfo
+
+
+@dataclass
+class ScanStats():
+    duration_in_seconds: float
+    directories_listed: int
+    directories_pruned: int
+    files_listed: int
+    files_downloaded: int
+    errors: int
+
+
+@dataclass
+class ScannedFile():
+    path: str
+    last_write_time: float
+    file_size: int
+    sink: Any
+
+
+class Scanner():
+    _factory: Callable[[], Samba]
+    _service: str
+    _extension: str
+    _connections: int
+    _full_rescan_every: int
+    _sink_factory: Callable[[], BinaryIO]
+
+    # Internal
+    _pool: "queue.Queue[Samba]"
+    _executor: ThreadPoolExecutor
+    _dir_last_write: Dict[str, float]
+    _scan_count: int
+
+    def __init__(
+        self,
+        factory: Callable[[], Samba],
+        service: str,
+        extension: str,
+        connections: int = 4,
+        full_rescan_every: int = 12,
+        sink_factory: Callable[[], BinaryIO] = io.BytesIO
+    ):
+        self._factory = factory
+        self._service = service
+        self._extension = extension.lower()
+        self._connections = connections
+        self._full_rescan_every = full_rescan_every
+        self._sink_factory = sink_factory
+
+        # Internal
+        self._pool = queue.Queue()
+        self._executor = None
+        self._dir_last_write = dict()
+        self._scan_count = 0
+
+    def connect(self) -> bool:
+        self.close()
+
+        for _ in range(self._connections):
+            smb = self._factory()
+            if not smb.connect():
+                self.close()
+                return False
+
+            self._pool.put(smb)
+
+        self._executor = ThreadPoolExecutor(max_workers=self._connections, thread_name_prefix="smb-scan")
+        return True
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+    def _list(self, path: str) -> List[FileInfo]:
+        smb = self._pool.get()
+        try:
+            return smb.listItems(self._service, path)
+        finally:
+            self._pool.put(smb)
+
+    def _download(self, path: str) -> Any:
+        smb = self._pool.get()
+        try:
+            sink = self._sink_factory()
+            smb.download_file(self._service, path, sink)
+            return sink
+        finally:
+            self._pool.put(smb)
+
+    def _invalidate(self, path: str):
+        # Forget the parents of a failed entry so that the next scan walks into them again
+        for dir in [ dir for dir in self._dir_last_write if path.startswith(dir) ]:
+            del self._dir_last_write[dir]
+
+    def scan(
+        self,
+        root: str,
+        select_downloads: Callable[[List[Tuple[str, FileInfo]]], List[Tuple[str, FileInfo]]],
+        on_file: Callable[[ScannedFile], None]
+    ) -> ScanStats:
+        if not root.endswith("/"):
+            raise Exception("`root` must ends with a splash (/)")
+
+        started = time.monotonic()
+        stats = ScanStats(0, 0, 0, 0, 0, 0)
+
+        # Directories are normally pruned on an unchanged last write time, but that only covers
+        # direct children, so every few scans the whole tree is listed again
+        is_full_scan = self._full_rescan_every <= 1 or self._scan_count % self._full_rescan_every == 0
+        self._scan_count += 1
+
+        listings: Dict[Future, str] = dict()
+        downloads: Dict[Future, Tuple[str, FileInfo]] = dict()
+        failure: BaseException = None
+
+        listings[self._executor.submit(self._list, root)] = root
+
+        while len(listings) > 0 or len(downloads) > 0:
+            done: Set[Future]
+            done, _ = wait(list(listings) + list(downloads), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future in listings:
+                    dir = listings.pop(future)
+
+                    try:
+                        items = future.result()
+                    except BaseException as e:
+                        logging.warning(f"Listing '{ self._service }{ dir }' failed: { e }")
+                        self._invalidate(dir)
+                        stats.errors += 1
+                        failure = e
+                        continue
+
+                    stats.directories_listed += 1
+                    files: List[Tuple[str, FileInfo]] = []
+
+                    for item in items:
+                        full_path = f"{ dir }{ item.file_name }"
+
+                        if item.is_directory:
+                            sub_dir = f"{ full_path }/"
+                            if not is_full_scan and self._dir_last_write.get(sub_dir) == item.last_write_time:
+                                stats.directories_pruned += 1
+                                continue
+
+                            self._dir_last_write[sub_dir] = item.last_write_time
+                            listings[self._executor.submit(self._list, sub_dir)] = sub_dir
+                        elif item.file_name.lower().endswith(f".{ self._extension }"):
+                            files.append((full_path, item))
+
+                    # One lookup per directory listing rather than per file
+                    stats.files_listed += len(files)
+                    for (full_path, item) in select_downloads(files):
+                        downloads[self._executor.submit(self._download, full_path)] = (full_path, item)
+                else:
+                    (full_path, item) = downloads.pop(future)
+
+                    try:
+                        sink = future.result()
+                    except BaseException as e:
+                        logging.warning(f"Downloading '{ full_path }' failed: { e }")
+                        self._invalidate(full_path)
+                        stats.errors += 1
+                        continue
+
+                    stats.files_downloaded += 1
+
+                    try:
+                        on_file(ScannedFile(
+                            path=full_path,
+                            last_write_time=item.last_write_time,
+                            file_size=item.file_size,
+                            sink=sink))
+                    except:
+                        logging.exception(f"Processing '{ full_path }' failed")
+                        self._invalidate(full_path)
+                        stats.errors += 1
+
+        stats.duration_in_seconds = time.monotonic() - started
+
+        # Only a scan that could not list anything at all is treated as a lost connection
+        if failure is not None and stats.directories_listed == 0:
+            raise failure
+
+        return stats
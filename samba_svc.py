@@ -1,63 +1,54 @@
-import re
 import sys
 import logging
-import tempfile
-import requests
 from db import Db
 from conf import Conf
-from samba import Samba
-from typing import Dict
+import hashlib
+from samba import Samba, Scanner, ScannedFile, FileInfo, BpsReport, BpsStreamParser
+from typing import Dict, List, Tuple
 import logging.handlers
-from server import Server
+from server import Server, Reactor
 import multiprocessing as mp
 from kvdb import KVDB, DBValue
-from logging import StreamHandler
-import xml.etree.ElementTree as ET
+from bus import Shipper, LogShipper, push_log_url, push_feed_url, to_feed_rows
 from datetime import datetime, timedelta
 
 FILE_EXTENSION = 'dat'
-class WebsocketHandler(StreamHandler):
-    _skip: bool
 
-    def __init__(self):
-        self._skip = False
-        StreamHandler.__init__(self)
-
-    def emit(self, record):
-        if self._skip:
-            return
-
-        msg = self.format(record)
-
-        try:
-            requests.post(f"http://localhost/push_log", json={
-                "type": "samba",
-                "message": msg
-            })
-        except:
-            self._skip = True
+# Upper bound for one reactor wait, so the loop still notices new work
+MAX_IDLE_IN_SECONDS = 1.0
 
 class App():
-    _smb: Samba
+    _scanner: Scanner
     _smb_connected: bool
     _smb_last_check: datetime
     _smb_last_disconnect: datetime
     _server_by_serial: Dict[str, Server]
+    _reactor: Reactor
     _db: KVDB
     _conf: Conf
     _sqlite_db: Db
     _queue: mp.Queue
+    _feed: Shipper
 
-    def __init__(self, queue: mp.Queue):
+    def __init__(self, queue: mp.Queue, feed: mp.Queue = None):
         self._sqlite_db = Db()
 
         conf = Conf("conf.yaml")
         self._conf = conf
 
-        self._smb = Samba(
-            conf.get_username(),
-            conf.get_password(),
-            conf.get_server())
+        # Saved reports also go to the web process' station cache
+        self._feed = Shipper("feed", push_feed_url(conf.get_agent_host(), conf.get_agent_port()), target_queue=feed)
+
+        self._scanner = Scanner(
+            lambda: Samba(
+                conf.get_username(),
+                conf.get_password(),
+                conf.get_server()),
+            conf.get_service(),
+            FILE_EXTENSION,
+            connections=conf.get_smb_connections(),
+            full_rescan_every=conf.get_full_rescan_every(),
+            sink_factory=BpsStreamParser)
 
         self._smb_connected = False
 
@@ -65,121 +56,93 @@ class App():
         self._smb_last_disconnect = datetime.now()
 
         self._server_by_serial = dict()
+        self._reactor = Reactor()
         self._db = KVDB()
         self._queue = queue
 
 
-    def search_xml_recursive(self, dir: str, indent: int) -> None:
-        if not dir.endswith("/"):
-            raise Exception("`dir` must ends with a splash (/)")
+    def search_xml(self, root: str) -> None:
+        logging.info(f"Scanning '{ self._conf.get_service() }{ root }'")
+
+        try:
+            stats = self._scanner.scan(root, self.select_unprocessed, self.process_xml)
+        except:
+            logging.exception("SMB scan failed, reconnecting")
+            self._scanner.close()
+            self._smb_connected = False
+            self._smb_last_disconnect = datetime.now()
+            return
 
-        logging.info(f"Listing files in '{ self._conf.get_service() }{ dir }")
-        items = self._smb.listItems(self._conf.get_service(), dir)
+        logging.info(
+            f"Scan finished in { stats.duration_in_seconds:.2f}s: { stats.directories_listed } directories listed, "
+            f"{ stats.directories_pruned } pruned, { stats.files_listed } files listed, "
+            f"{ stats.files_downloaded } downloaded, { stats.errors } errors")
 
-        for item in items:
-            logging.info(f"{ '-' * indent }[{ 'D' if item.is_directory else 'F' }] { item.file_name }")
 
-            if item.is_directory:
-                self.search_xml_recursive(f"{ dir }{ item.file_name }/", indent + 2)
-            else:
-                if item.file_name.lower().endswith(f".{ FILE_EXTENSION }"):
-                    self.process_xml(f"{ dir }{ item.file_name }", item.last_write_time)
+    def select_unprocessed(self, files: List[Tuple[str, FileInfo]]) -> List[Tuple[str, FileInfo]]:
+        known = self._db.get_many([ full_path for (full_path, _) in files ])
 
+        selected = []
+        for (full_path, item) in files:
+            db = known.get(full_path)
+            if (db is None) or (db.last_write != datetime.utcfromtimestamp(item.last_write_time)):
+                selected.append((full_path, item))
 
-    def _get_serial_from_xml(self, xml_data: bytes) -> bytes | None:
-        match = re.search(b'SerialNumber="(.+?)"', xml_data, re.MULTILINE | re.DOTALL)
-        match: re.Match
-        if match:
-            return match.group(1)
+        return selected
 
-        return None
 
+    def process_xml(self, file: ScannedFile) -> bool:
+        logging.info(f"Processing '{ file.path }'")
 
-    def process_xml(self, full_path: str, last_write_time: float) -> bool:
-        logging.info(f"Processing '{ full_path }'")
+        full_path = file.path
+        last_write: datetime = datetime.utcfromtimestamp(file.last_write_time)
+        report: BpsReport = file.sink.close()
+        xml_data = report.raw
+        digest = hashlib.sha1(xml_data).hexdigest()
 
-        last_write: datetime = datetime.utcfromtimestamp(last_write_time)
         db = self._db.get(full_path)
-        if (db is not None) and (db.last_write == last_write):
-            logging.info(f"  Already processed at { db.last_processed }")
+        if (db is not None) and (db.hash == digest):
+            logging.info(f"  Content unchanged since { db.last_processed }, skipping")
+            self._db.set(full_path, DBValue(
+                last_processed=db.last_processed,
+                last_write=last_write,
+                size=file.file_size,
+                hash=digest))
             return False
 
-        file_obj = tempfile.NamedTemporaryFile()
-        file_attributes, filesize = self._smb.download_file(self._conf.get_service(), full_path, file_obj)
-        file_obj.seek(0)
-
-        xml_data = file_obj.read()
-        serial_bytes = self._get_serial_from_xml(xml_data)
-
-        serial = None
-        if serial_bytes is not None:
-            serial = serial_bytes.decode("utf-8")
+        serial = report.serial
 
         if serial in self._server_by_serial:
             logging.info(f"  Broadcasting data for serial '{ serial }'")
             self._server_by_serial[serial].send(xml_data)
             self._server_by_serial[serial].send(b"\r\n\r\n")
 
+        # SMB save shared files to sqlite database
+        if report.error is None:
+            row = self._sqlite_db.save_pos(serial, report.to_text(), None, report.created)
+            self._feed.offer_many(to_feed_rows([ row ]))
+            logging.info("SMB shared file is saved to SQLite")
+        else:
+            logging.warning(f"  Malformed BPS file, not saved: { report.error }")
+
+        # Only recorded once persisted, so a failure is retried on the next scan
         self._db.set(full_path, DBValue(
             last_processed=datetime.now(),
-            last_write=last_write))
-        
-        # SMB save shared files to sqlite database
-        parsed_xml_data, _BPSCreated = self._parse_xml_data(xml_data)
-        self._sqlite_db.save_pos(serial, parsed_xml_data, None, _BPSCreated)
-        logging.info("SMB shared file is saved to SQLite")
+            last_write=last_write,
+            size=file.file_size,
+            hash=digest))
         logging.info("Done")
         return True
 
-    def _parse_xml_data(self, xml_data: bytes):
-        parsed_xml_data = None
-        # Create element tree for XML
-        tree = ET.ElementTree(ET.fromstring(str(xml_data, 'utf-8')))
-        root = tree.getroot()
-
-        _BPSCreated = root.attrib["Created"]
-        ele = tree.find('.//Machine')
-        _SerialNumber = ele.attrib["SerialNumber"]
-        ele = tree.find('.//ParameterSection')
-        _StartTime = ele.attrib["StartTime"]
-        _EndTime = ele.attrib["EndTime"]
-        ele = tree.find('.//HeadercardUnit')
-        _HeaderCardID = ele.attrib["HeaderCardID"]
-        _DepositID = ele.attrib["DepositID"]
-        
-        _counters = []
-        for counter in root.iter('Counter'):
-            DenomID = counter.attrib["DenomID"]
-            Value = counter.attrib["Value"]
-            Number = counter.attrib["Number"]
-            Total = int(Value) * int(Number)
-            _counters.append({"DenomID":DenomID, "Value":Value, "Number":Number, "Total":Total})
-
-        # Create text to display xml data 
-        parsed_xml_data = f'BPS Created="{_BPSCreated}"\r\nMachine SerialNumber="{_SerialNumber}"\r\nStartTime="{_StartTime}" EndTime="{_EndTime}"\r\nHeaderCardID="{_HeaderCardID}" DepositID="{_DepositID}"\r\n'
-
-        TotalAmount: int = 0
-
-        for counter in _counters:
-            DenomID = counter["DenomID"]
-            Value = counter["Value"]
-            Number = counter["Number"]
-            Total = counter["Total"]
-            TotalAmount += Total
-            parsed_xml_data += f'DenomID="{DenomID}" Value="{Value}" Number="{Number}" Total="{Total}" \r\n'
-
-        parsed_xml_data += f'TotalAmount={TotalAmount}'
-        return parsed_xml_data, _BPSCreated
-
     def _start_servers(self):
         servers = self._conf.get_servers()
         for server in servers:
-            self._server_by_serial[server.serial] = Server(server.port, server.name)
+            self._server_by_serial[server.serial] = Server(server.port, server.name, self._reactor)
             self._server_by_serial[server.serial].start()
 
 
     def _connect_smb(self) -> bool:
-        self._smb_connected = self._smb.connect()
+        self._smb_connected = self._scanner.connect()
         if not self._smb_connected:
             logging.warning(f"Can't connect to SMB host, scheduled to reconnect after { self._conf.get_reconnect_inverval() } seconds")
             self._smb_last_disconnect = datetime.now()
@@ -195,7 +158,20 @@ class App():
             return
 
 
+    def _next_timeout(self, now: datetime) -> float:
+        if not self._conf.get_smb_enabled():
+            return MAX_IDLE_IN_SECONDS
+
+        if self._smb_connected:
+            due = self._smb_last_check + timedelta(seconds=self._conf.get_interval_in_seconds())
+        else:
+            due = self._smb_last_disconnect + timedelta(seconds=self._conf.get_reconnect_inverval())
+
+        return min(max((due - now).total_seconds(), 0), MAX_IDLE_IN_SECONDS)
+
+
     def start(self):
+        self._feed.start()
         self._start_servers()
 
         if self._conf.get_smb_enabled():
@@ -211,15 +187,18 @@ class App():
 
                 if self._smb_connected and (now - self._smb_last_check > timedelta(seconds=self._conf.get_interval_in_seconds())):
                     self._smb_last_check = now
-                    self.search_xml_recursive(self._conf.get_root(), 0)
+                    self.search_xml(self._conf.get_root())
 
-            for _, server in self._server_by_serial.items():
-                server.iterate(0.001)
+            self._reactor.iterate(self._next_timeout(datetime.now()))
 
             self._process_queue()
 
 
-def run_app(queue: mp.Queue, log_to_file: bool):
+def run_app(queue: mp.Queue, log_to_file: bool, logs: mp.Queue = None, feed: mp.Queue = None):
+    conf = Conf("conf.yaml")
+    shipper = LogShipper("samba", push_log_url(conf.get_agent_host(), conf.get_agent_port()), log_queue=logs)
+    shipper.start()
+
     if log_to_file:
         logging.basicConfig(
             format="[%(asctime)s] %(message)s",
@@ -229,7 +208,7 @@ def run_app(queue: mp.Queue, log_to_file: bool):
                     "logs/samba_svc.txt",
                     maxBytes=1024 * 1024 * 100,
                     backupCount=10),
-                WebsocketHandler()
+                shipper.handler()
             ]
         )
     else:
@@ -238,12 +217,12 @@ def run_app(queue: mp.Queue, log_to_file: bool):
             level=logging.INFO,
             handlers=[
                 logging.StreamHandler(sys.stdout),
-                WebsocketHandler()
+                shipper.handler()
             ]
         )
 
     try:
-        app = App(queue)
+        app = App(queue, feed)
         app.start()
     except KeyboardInterrupt:
         logging.info("Quitting ...")
@@ -1 +1,2 @@
-from .server import Server
\ No newline at end of file
+from .server import Server
+from .reactor import Reactor
\ No newline at end of file
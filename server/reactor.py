@@ -0,0 +1,33 @@
+import time
+import socket
+import selectors
+from typing import Callable
+
+
+class Reactor():
+    _selector: selectors.BaseSelector
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+
+    def register(self, sock: socket.socket, events: int, callback: Callable[[socket.socket, int], None]):
+        self._selector.register(sock, events, callback)
+
+    def modify(self, sock: socket.socket, events: int, callback: Callable[[socket.socket, int], None]):
+        self._selector.modify(sock, events, callback)
+
+    def unregister(self, sock: socket.socket):
+        self._selector.unregister(sock)
+
+    def iterate(self, timeout: float | None = None):
+        # Sleeps in the OS until a socket is ready or the timeout expires
+        if len(self._selector.get_map()) == 0:
+            if timeout is not None and timeout > 0:
+                time.sleep(timeout)
+            return
+
+        for key, mask in self._selector.select(timeout):
+            key.data(key.fileobj, mask)
+
+    def close(self):
+        self._selector.close()
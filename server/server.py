@@ -1,24 +1,30 @@
 import socket
-import select
 import logging
-from typing import List, Dict, Any
+import selectors
+from collections import deque
+from typing import Deque, Dict, Any
+
+from .reactor import Reactor
+
+RECV_SIZE = 1024
+
 
 class Server():
     _port: int
     _name: str
     _socket: socket.socket
     _started: bool
-    _sock_list: List[socket.socket]
-    _data_by_sock: Dict[socket.socket, bytes]
+    _reactor: Reactor
+    _pending_by_sock: Dict[socket.socket, Deque[memoryview]]
     _address_by_sock: Dict[socket.socket, Any]
 
 
-    def __init__(self, port: int, name: str):
+    def __init__(self, port: int, name: str, reactor: Reactor | None = None):
         self._port = port
         self._name = name
         self._started = False
-        self._readable = []
-        self._data_by_sock = dict()
+        self._reactor = reactor if reactor is not None else Reactor()
+        self._pending_by_sock = dict()
         self._address_by_sock = dict()
 
 
@@ -31,47 +37,86 @@ class Server():
 
         self._socket.bind(("0.0.0.0", self._port))
         self._socket.listen(10)
+        self._socket.setblocking(False)
         self._started = True
-        self._sock_list = [self._socket]
+
+        self._reactor.register(self._socket, selectors.EVENT_READ, self._on_accept)
 
 
     def iterate(self, timeout: float | None = None):
-        write_list = [ sock for sock in self._sock_list if sock is not self._socket ]
-
-        readable, writable, errored = select.select(self._sock_list, write_list, [], timeout)
-        readable: List[socket.socket]
-        writable: List[socket.socket]
-        errored: List[socket.socket]
-
-        for sock in readable:
-            if sock is self._socket:
-                client_socket, address = self._socket.accept()
-                self._sock_list.append(client_socket)
-                self._data_by_sock[client_socket] = b''
-                self._address_by_sock[client_socket] = address
-
-                logging.info(f"'{ self._name }' got connection from { address }")
-            else:
-                data = sock.recv(1024)
-                if data:
-                    logging.info(f"'{ self._name }' received: { data } from [{ self._address_by_sock[sock] }]")
-                else:
-                    logging.info(f"'{ self._name }' lost connection from client")
-                    sock.close()
-                    self._sock_list.remove(sock)
-                    del self._data_by_sock[sock]
-
-        for sock in writable:
-            if sock in self._data_by_sock:
-                buf = self._data_by_sock[sock]
-                if len(buf) == 0:
-                    continue
+        self._reactor.iterate(timeout)
+
+
+    def _on_accept(self, sock: socket.socket, mask: int):
+        try:
+            client_socket, address = self._socket.accept()
+        except BlockingIOError:
+            return
+
+        client_socket.setblocking(False)
+        self._pending_by_sock[client_socket] = deque()
+        self._address_by_sock[client_socket] = address
+        self._reactor.register(client_socket, selectors.EVENT_READ, self._on_client)
+
+        logging.info(f"'{ self._name }' got connection from { address }")
+
+
+    def _on_client(self, sock: socket.socket, mask: int):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = sock.recv(RECV_SIZE)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                data = b''
+
+            if data:
+                logging.info(f"'{ self._name }' received: { data } from [{ self._address_by_sock[sock] }]")
+            elif data is not None:
+                logging.info(f"'{ self._name }' lost connection from client")
+                self._drop_client(sock)
+                return
 
+        if mask & selectors.EVENT_WRITE:
+            self._flush(sock)
+
+
+    def _flush(self, sock: socket.socket):
+        pending = self._pending_by_sock[sock]
+
+        while len(pending) > 0:
+            buf = pending[0]
+
+            try:
                 sent = sock.send(buf)
-                if sent > 0:
-                    self._data_by_sock[sock] = buf[sent:]
+            except BlockingIOError:
+                return
+            except OSError:
+                self._drop_client(sock)
+                return
+
+            if sent < len(buf):
+                pending[0] = buf[sent:]
+                return
+
+            pending.popleft()
+
+        # Nothing left to write, stop waiting for writability
+        self._reactor.modify(sock, selectors.EVENT_READ, self._on_client)
+
+
+    def _drop_client(self, sock: socket.socket):
+        self._reactor.unregister(sock)
+        sock.close()
+        del self._pending_by_sock[sock]
+        del self._address_by_sock[sock]
 
 
     def send(self, data: bytes):
-        for k, v in self._data_by_sock.items():
-            self._data_by_sock[k] = v + data
+        view = memoryview(data)
+
+        for sock, pending in self._pending_by_sock.items():
+            if len(pending) == 0:
+                self._reactor.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self._on_client)
+
+            pending.append(view)
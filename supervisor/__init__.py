@@ -0,0 +1 @@
+from .supervisor import Supervisor, shard_of, STOP_COMMAND
\ No newline at end of file
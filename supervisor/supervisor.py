@@ -0,0 +1,217 @@
+import time
+import zlib
+import queue
+import logging
+import threading
+import logging.handlers
+import multiprocessing as mp
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+from bus import drain_queue
+
+# Longest wait before a crashed worker is started again
+RESTART_BACKOFF_MAX_IN_SECONDS = 60
+
+# A worker that stayed up this long starts over with the shortest backoff
+STABLE_AFTER_IN_SECONDS = 60
+
+SUMMARY_INTERVAL_IN_SECONDS = 60
+
+# How long a worker gets to flush and close before it is terminated
+STOP_TIMEOUT_IN_SECONDS = 10
+
+STOP_COMMAND = { "TYPE": "stop" }
+
+
+def shard_of(key: str, count: int) -> int:
+    # crc32 gives the same answer in every process and across restarts, hash() does not
+    return zlib.crc32(key.encode()) % count
+
+
+@dataclass
+class WorkerState():
+    index: int
+    process: mp.Process
+    commands: mp.Queue
+    started_at: float
+    restarts: int
+    restart_at: float | None
+    status: Dict[str, Any] | None
+
+
+class Supervisor():
+    _name: str
+    _count: int
+    _target: Callable
+    _queue: mp.Queue
+
+    # Internal
+    _status: mp.Queue
+    _log_records: mp.Queue
+    _listener: logging.handlers.QueueListener
+    _workers: List[WorkerState]
+    _forwarder: threading.Thread
+    _last_summary: float
+    _stopping: bool
+
+    def __init__(self, name: str, count: int, target: Callable, queue: mp.Queue = None):
+        # target(index, count, commands, status, log_records) runs in each worker process
+        self._name = name
+        self._count = count
+        self._target = target
+        self._queue = queue
+
+        # Internal
+        self._status = mp.Queue()
+        self._log_records = mp.Queue()
+        self._listener = None
+        self._workers = []
+        self._forwarder = None
+        self._last_summary = time.monotonic()
+        self._stopping = False
+
+    def run(self):
+        # Worker records go through the handlers of this process, file and log shipper alike
+        self._listener = logging.handlers.QueueListener(self._log_records, *logging.getLogger().handlers)
+        self._listener.start()
+
+        for index in range(self._count):
+            self._workers.append(WorkerState(
+                index=index,
+                process=None,
+                commands=None,
+                started_at=0.0,
+                restarts=0,
+                restart_at=None,
+                status=None))
+            self._spawn(self._workers[index])
+
+        if self._queue is not None:
+            self._forwarder = threading.Thread(target=self._forward_commands, name="command-forwarder", daemon=True)
+            self._forwarder.start()
+
+        try:
+            while True:
+                self._collect_status(timeout=1)
+                self._check_workers()
+                self._log_summary()
+        except KeyboardInterrupt:
+            logging.info("Quitting")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopping = True
+
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.commands.put(STOP_COMMAND)
+
+        deadline = time.monotonic() + STOP_TIMEOUT_IN_SECONDS
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+
+            worker.process.join(max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                logging.warning(f"{ self._name } worker { worker.index } did not stop in time, terminating")
+                worker.process.terminate()
+                worker.process.join()
+
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _spawn(self, worker: WorkerState):
+        # A worker killed inside get() leaves the queue locked, so every start gets a new one
+        worker.commands = mp.Queue()
+        worker.process = mp.Process(
+            target=self._target,
+            args=(worker.index, self._count, worker.commands, self._status, self._log_records),
+            name=f"{ self._name }-{ worker.index }",
+            daemon=True)
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        worker.status = None
+
+        logging.info(f"Started { self._name } worker { worker.index } (pid { worker.process.pid })")
+
+    def _forward_commands(self):
+        drain_queue(self._queue, "Command", lambda: not self._stopping, self._forward)
+
+    def _forward(self, msg: Any):
+        # Discovery messages go to the worker owning the proxy, anything else to all of them
+        if isinstance(msg, dict) and "NAME" in msg:
+            self._workers[shard_of(msg["NAME"], self._count)].commands.put(msg)
+        else:
+            for worker in self._workers:
+                worker.commands.put(msg)
+
+    def _collect_status(self, timeout: float):
+        try:
+            status = self._status.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+        while True:
+            self._workers[status["shard"]].status = status
+
+            try:
+                status = self._status.get_nowait()
+            except queue.Empty:
+                return
+
+    def _check_workers(self):
+        now = time.monotonic()
+
+        for worker in self._workers:
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self._spawn(worker)
+                continue
+
+            if worker.process.is_alive():
+                continue
+
+            if now - worker.started_at >= STABLE_AFTER_IN_SECONDS:
+                worker.restarts = 0
+
+            backoff = min(2 ** worker.restarts, RESTART_BACKOFF_MAX_IN_SECONDS)
+            worker.restarts += 1
+            worker.restart_at = now + backoff
+
+            logging.warning(
+                f"{ self._name } worker { worker.index } exited with code { worker.process.exitcode }, "
+                f"restarting in { backoff } seconds")
+
+    def _log_summary(self):
+        now = time.monotonic()
+        if now - self._last_summary < SUMMARY_INTERVAL_IN_SECONDS:
+            return
+
+        self._last_summary = now
+
+        total_proxies = 0
+        total_connected = 0
+        total_open = 0
+        for worker in self._workers:
+            status = worker.status
+            if status is None:
+                logging.info(f"{ self._name } worker { worker.index }: no status, { worker.restarts } restarts")
+                continue
+
+            total_proxies += status["proxies"]
+            total_connected += status["connected"]
+            total_open += status["reconnect"]["open"]
+            writer = status["writer"]
+            logging.info(
+                f"{ self._name } worker { worker.index } (pid { status['pid'] }): "
+                f"{ status['connected'] }/{ status['proxies'] } origins connected, "
+                f"{ writer['written'] } rows written, { writer['dropped'] } dropped, "
+                f"queue { writer['queue_depth'] }, { status['reconnect']['open'] } circuits open, "
+                f"{ worker.restarts } restarts")
+
+        logging.info(
+            f"{ self._name }: { total_connected }/{ total_proxies } origins connected across { self._count } workers, "
+            f"{ total_open } circuits open")
@@ -1,4 +1,8 @@
 from .tcpclient import TCPClient
 from .tcpserver import TCPServer
 from .tcpproxy import TCPProxy
-from .tcpconnectionhandler import TCPConnectionHandler
\ No newline at end of file
+from .tcpconnectionhandler import TCPConnectionHandler
+from .framing import Framer, create_framer
+from .reconnect import ReconnectScheduler
+from .keepalive import KeepaliveOptions, IdleWheel
+from .multiplex import MultiplexServer
\ No newline at end of file
@@ -0,0 +1,136 @@
+import codecs
+from typing import List
+
+FRAMING_CHUNK = "chunk"
+FRAMING_DELIMITER = "delimiter"
+FRAMING_IDLE = "idle"
+FRAMING_LENGTH_PREFIXED = "length_prefixed"
+
+# A frame that grows past this without completing is emitted as it is
+DEFAULT_MAX_FRAME_SIZE = 1024 * 1024
+
+
+class Framer():
+    # Cuts a byte stream into messages. Frames are the bytes as received, so forwarding
+    # them keeps the stream identical, payload() is what gets stored.
+    _buffer: bytearray
+    _max_frame_size: int
+
+    def __init__(self, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE) -> None:
+        self._buffer = bytearray()
+        self._max_frame_size = max_frame_size
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self._buffer += data
+        frames = self._split()
+
+        if len(self._buffer) >= self._max_frame_size:
+            frames += self.flush()
+
+        return frames
+
+    def _split(self) -> List[bytes]:
+        return []
+
+    def flush(self) -> List[bytes]:
+        # On idle and on close, whatever is buffered goes out as one frame
+        if len(self._buffer) == 0:
+            return []
+
+        frame = bytes(self._buffer)
+        self._buffer.clear()
+        return [ frame ]
+
+    def pending(self) -> bool:
+        return len(self._buffer) > 0
+
+    def payload(self, frame: bytes) -> bytes:
+        return frame
+
+    def reset(self):
+        self._buffer.clear()
+
+
+class ChunkFramer(Framer):
+    # Every TCP segment is a message, as before framing existed
+    def feed(self, data: bytes) -> List[bytes]:
+        return [ data ]
+
+
+class DelimiterFramer(Framer):
+    _delimiter: bytes
+
+    def __init__(self, delimiter: bytes = b"\r\n", max_frame_size: int = DEFAULT_MAX_FRAME_SIZE) -> None:
+        Framer.__init__(self, max_frame_size)
+        self._delimiter = delimiter
+
+    def _split(self) -> List[bytes]:
+        frames = []
+        start = 0
+        while True:
+            end = self._buffer.find(self._delimiter, start)
+            if end < 0:
+                break
+
+            end += len(self._delimiter)
+            frames.append(bytes(self._buffer[start:end]))
+            start = end
+
+        # One compaction per feed, not one per frame
+        if start > 0:
+            del self._buffer[:start]
+
+        return frames
+
+
+class IdleFramer(Framer):
+    # Segments arriving back to back are one message, the owner flushes after a quiet period
+    pass
+
+
+class LengthPrefixedFramer(Framer):
+    _header_size: int
+    _byteorder: str
+
+    def __init__(self, header_size: int = 4, byteorder: str = "big", max_frame_size: int = DEFAULT_MAX_FRAME_SIZE) -> None:
+        Framer.__init__(self, max_frame_size)
+        self._header_size = header_size
+        self._byteorder = byteorder
+
+    def _split(self) -> List[bytes]:
+        frames = []
+        start = 0
+        while len(self._buffer) - start >= self._header_size:
+            size = int.from_bytes(self._buffer[start:start + self._header_size], self._byteorder)
+            end = start + self._header_size + size
+            if end > len(self._buffer):
+                break
+
+            frames.append(bytes(self._buffer[start:end]))
+            start = end
+
+        if start > 0:
+            del self._buffer[:start]
+
+        return frames
+
+    def payload(self, frame: bytes) -> bytes:
+        return frame[self._header_size:]
+
+
+def create_framer(mode: str, delimiter: bytes = b"\r\n", max_frame_size: int = DEFAULT_MAX_FRAME_SIZE) -> Framer:
+    if mode == FRAMING_CHUNK:
+        return ChunkFramer(max_frame_size)
+    if mode == FRAMING_DELIMITER:
+        return DelimiterFramer(delimiter, max_frame_size)
+    if mode == FRAMING_IDLE:
+        return IdleFramer(max_frame_size)
+    if mode == FRAMING_LENGTH_PREFIXED:
+        return LengthPrefixedFramer(max_frame_size=max_frame_size)
+
+    raise Exception(f"Unknown framing mode '{ mode }'")
+
+
+def create_decoder() -> codecs.IncrementalDecoder:
+    # A character split across two frames is completed by the next one instead of failing
+    return codecs.getincrementaldecoder("utf-8")(errors="replace")
@@ -0,0 +1,120 @@
+import math
+import socket
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, List, Set
+
+
+@dataclass
+class KeepaliveOptions():
+    # The kernel probes a connection silent for idle seconds every interval seconds
+    # and drops it after count unanswered probes
+    idle: int
+    interval: int
+    count: int
+
+
+def set_keepalive(transport: asyncio.Transport, options: KeepaliveOptions):
+    sock = transport.get_extra_info("socket")
+    if sock is None:
+        return
+
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, options.idle)
+        elif hasattr(socket, "TCP_KEEPALIVE"):
+            # macOS names the idle time differently
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, options.idle)
+        elif hasattr(socket, "SIO_KEEPALIVE_VALS"):
+            # Older Windows only takes idle and interval, in milliseconds, through ioctl
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, options.idle * 1000, options.interval * 1000))
+            return
+
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, options.interval)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, options.count)
+    except OSError:
+        logging.exception("Failed to enable TCP keepalive")
+
+
+class IdleWheel():
+    # One timer for every read-idle timeout of the process. A connection sits in the slot
+    # of its deadline, reads only stamp it, and it is moved when its slot comes up.
+    _resolution: float
+    _slots: List[Set[Any]]
+    _cursor: int
+    _count: int
+    _handle: asyncio.TimerHandle
+
+    # Loop time of the last tick, cheaper to read than loop.time() on every chunk
+    now: float
+
+    def __init__(self, resolution: float = 1.0, size: int = 64) -> None:
+        self._resolution = resolution
+        self._slots = [ set() for _ in range(size) ]
+        self._cursor = 0
+        self._count = 0
+        self._handle = None
+        self.now = 0.0
+
+    def add(self, conn: Any):
+        # conn is a TCPProtocol with a read timeout
+        if self._handle is None:
+            self.now = asyncio.get_running_loop().time()
+            self._arm()
+
+        conn._last_read = self.now
+        self._place(conn, self.now + conn._read_timeout)
+        self._count += 1
+
+    def remove(self, conn: Any):
+        if conn._wheel_slot is None:
+            return
+
+        self._slots[conn._wheel_slot].discard(conn)
+        conn._wheel_slot = None
+        self._count -= 1
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _place(self, conn: Any, deadline: float):
+        # Deadlines past the end of the wheel wait in the last slot and are placed again
+        ticks = math.ceil((deadline - self.now) / self._resolution)
+        ticks = min(max(ticks, 1), len(self._slots) - 1)
+
+        index = (self._cursor + ticks) % len(self._slots)
+        self._slots[index].add(conn)
+        conn._wheel_slot = index
+
+    def _arm(self):
+        self._handle = asyncio.get_running_loop().call_later(self._resolution, self._tick)
+
+    def _tick(self):
+        self.now = asyncio.get_running_loop().time()
+        self._cursor = (self._cursor + 1) % len(self._slots)
+
+        due = self._slots[self._cursor]
+        self._slots[self._cursor] = set()
+
+        for conn in due:
+            deadline = conn._last_read + conn._read_timeout
+            if deadline > self.now:
+                self._place(conn, deadline)
+                continue
+
+            conn._wheel_slot = None
+            self._count -= 1
+            conn.on_read_idle()
+
+        # Nothing to watch, the next add() starts the timer again
+        if self._count > 0:
+            self._arm()
+        else:
+            self._handle = None
@@ -0,0 +1,179 @@
+import logging
+from typing import Dict, Set
+
+from .tcpserver import TCPServer
+from .tcpprotocol import DEFAULT_WRITE_LIMIT, LAG_POLICY_COALESCE
+from .tcpconnectionhandler import TCPConnectionHandler
+from .keepalive import KeepaliveOptions, IdleWheel
+
+# Client to server, one command per line:
+#   SUBSCRIBE <name>[,<name>...]     or SUBSCRIBE * for every proxy
+#   UNSUBSCRIBE <name>[,<name>...]   or UNSUBSCRIBE *
+# answered with "OK <subscriptions>" or "ERR <reason>".
+#
+# Server to client, after subscribing:
+#   FRAME <length> <name>\r\n followed by length bytes, as received from the origin
+#   EVENT <name> connected|disconnected\r\n
+ALL_NAMES = "*"
+
+# A client that sends a longer line than this without a newline is disconnected
+MAX_COMMAND_SIZE = 64 * 1024
+
+
+class MultiplexServer(TCPConnectionHandler):
+    # One listener for many proxies, clients pick the stations they want over a single socket
+    _server: TCPServer
+    _names: Set[str]
+    _subscribers: Dict[str, Set[int]]
+    _subscriptions: Dict[int, Set[str]]
+    _commands: Dict[int, bytearray]
+
+    def __init__(
+        self,
+        name: str,
+        host: str,
+        port: int,
+        write_limit: int = DEFAULT_WRITE_LIMIT,
+        lag_policy: str = LAG_POLICY_COALESCE,
+        keepalive: KeepaliveOptions = None,
+        idle_wheel: IdleWheel = None,
+        read_timeout: float = 0
+    ) -> None:
+        self._server = TCPServer(
+            name,
+            host,
+            port,
+            self,
+            write_limit=write_limit,
+            lag_policy=lag_policy,
+            keepalive=keepalive,
+            idle_wheel=idle_wheel,
+            read_timeout=read_timeout
+        )
+        self._names = set()
+        self._subscribers = { ALL_NAMES: set() }
+        self._subscriptions = dict()
+        self._commands = dict()
+
+    async def start(self) -> bool:
+        if not await self._server.start():
+            return False
+
+        logging.info(f"Started shared listener '{ self._server.name() }'")
+        return True
+
+    async def stop(self):
+        await self._server.stop()
+
+        self._subscribers = { ALL_NAMES: set() }
+        self._subscriptions.clear()
+        self._commands.clear()
+
+    def register(self, name: str):
+        self._names.add(name)
+
+    def unregister(self, name: str):
+        # Subscriptions are kept, a proxy restarted by a reload keeps its clients
+        self._names.discard(name)
+
+    def publish(self, name: str, data: bytes):
+        ids = self._subscribers.get(name)
+        everyone = self._subscribers[ALL_NAMES]
+        if not ids and not everyone:
+            return
+
+        # Header and payload are joined once, every subscriber gets the same buffer
+        message = b"FRAME %d %s\r\n" % (len(data), name.encode()) + data
+        self._send(name, message)
+
+    def publish_event(self, name: str, event: str):
+        self._send(name, f"EVENT { name } { event }\r\n".encode())
+
+    def _send(self, name: str, message: bytes):
+        ids = self._subscribers.get(name, set())
+        everyone = self._subscribers[ALL_NAMES]
+
+        for id in (ids | everyone if len(everyone) > 0 else ids):
+            self._server.send_to(id, message)
+
+    def _subscribe(self, id: int, names: Set[str]) -> str:
+        unknown = [ name for name in names if name != ALL_NAMES and name not in self._names ]
+        if len(unknown) > 0:
+            return f"ERR unknown { ','.join(sorted(unknown)) }"
+
+        for name in names:
+            self._subscribers.setdefault(name, set()).add(id)
+            self._subscriptions[id].add(name)
+
+        return f"OK { len(self._subscriptions[id]) }"
+
+    def _unsubscribe(self, id: int, names: Set[str]) -> str:
+        if ALL_NAMES in names:
+            names = set(self._subscriptions[id])
+
+        for name in names:
+            self._subscriptions[id].discard(name)
+            subscribers = self._subscribers.get(name)
+            if subscribers is not None:
+                subscribers.discard(id)
+                if len(subscribers) == 0 and name != ALL_NAMES:
+                    del self._subscribers[name]
+
+        return f"OK { len(self._subscriptions[id]) }"
+
+    def _handle_command(self, id: int, line: str) -> str:
+        (command, _, args) = line.strip().partition(" ")
+        names = { name.strip() for name in args.split(",") if name.strip() }
+        if len(names) == 0:
+            return "ERR no names"
+
+        command = command.upper()
+        if command == "SUBSCRIBE":
+            return self._subscribe(id, names)
+        if command == "UNSUBSCRIBE":
+            return self._unsubscribe(id, names)
+
+        return f"ERR unknown command '{ command }'"
+
+    # Handler
+    def on_new_connection(
+        self,
+        id: int,
+        remote_host: str,
+        remote_port: int
+    ):
+        logging.debug(f"Shared listener connection { id } from { remote_host }:{ remote_port }")
+        self._subscriptions[id] = set()
+        self._commands[id] = bytearray()
+
+    def on_data_received(
+        self,
+        id: int,
+        data: bytes
+    ):
+        buffer = self._commands.get(id)
+        if buffer is None:
+            return
+
+        buffer += data
+        while True:
+            end = buffer.find(b"\n")
+            if end < 0:
+                break
+
+            line = buffer[:end].decode(errors="replace")
+            del buffer[:end + 1]
+
+            if line.strip():
+                self._server.send_to(id, f"{ self._handle_command(id, line) }\r\n".encode())
+
+        if len(buffer) > MAX_COMMAND_SIZE:
+            logging.warning(f"Shared listener connection { id } sent an oversized command, closing")
+            self._server.close(id)
+
+    def on_closed(self, id: int):
+        if id in self._subscriptions:
+            self._unsubscribe(id, { ALL_NAMES })
+            del self._subscriptions[id]
+
+        self._commands.pop(id, None)
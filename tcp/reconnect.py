@@ -0,0 +1,128 @@
+import time
+import random
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+@dataclass
+class OriginState():
+    failures: int
+    circuit: str
+    opened_at: float | None
+    last_error: str | None
+
+
+class ReconnectScheduler():
+    # Shared by every proxy of a process, so a site going down does not turn into
+    # hundreds of connects retrying in lockstep
+    _max_backoff: float
+    _connect_timeout: float
+    _failure_threshold: int
+    _open_interval: float
+    _jitter: float
+
+    # Internal
+    _origins: Dict[str, OriginState]
+    _slots: asyncio.Semaphore
+    _in_flight: int
+
+    def __init__(
+        self,
+        max_backoff: float = 300,
+        connect_timeout: float = 10,
+        max_concurrent: int = 16,
+        failure_threshold: int = 5,
+        open_interval: float = 300,
+        jitter: float = 0.2
+    ) -> None:
+        self._max_backoff = max_backoff
+        self._connect_timeout = connect_timeout
+        self._failure_threshold = failure_threshold
+        self._open_interval = open_interval
+        self._jitter = jitter
+
+        # Internal
+        self._origins = dict()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._in_flight = 0
+
+    def _state(self, key: str) -> OriginState:
+        state = self._origins.get(key)
+        if state is None:
+            state = OriginState(failures=0, circuit=CIRCUIT_CLOSED, opened_at=None, last_error=None)
+            self._origins[key] = state
+
+        return state
+
+    def delay(self, key: str, interval: float) -> float:
+        # interval is the proxy's own reconnect_inverval, the first retry waits just that
+        state = self._state(key)
+        if state.circuit != CIRCUIT_CLOSED:
+            delay = self._open_interval
+        elif state.failures == 0:
+            delay = interval
+        else:
+            delay = min(interval * 2 ** (state.failures - 1), self._max_backoff)
+
+        return delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+    async def connect(self, key: str, open: Callable[[], Awaitable[Any]]) -> bool:
+        # open() makes one attempt and raises on failure, at most max_concurrent are in flight
+        async with self._slots:
+            state = self._state(key)
+            if state.circuit == CIRCUIT_OPEN:
+                state.circuit = CIRCUIT_HALF_OPEN
+
+            self._in_flight += 1
+            try:
+                await asyncio.wait_for(open(), self._connect_timeout)
+            except asyncio.TimeoutError:
+                self.on_failure(key, f"timed out after { self._connect_timeout } seconds")
+                return False
+            except Exception as e:
+                self.on_failure(key, str(e) or type(e).__name__)
+                return False
+            finally:
+                self._in_flight -= 1
+
+        self.on_success(key)
+        return True
+
+    def on_success(self, key: str):
+        state = self._state(key)
+        if state.circuit != CIRCUIT_CLOSED:
+            logging.info(f"Origin { key } is back after { state.failures } failed connects, circuit closed")
+
+        state.failures = 0
+        state.circuit = CIRCUIT_CLOSED
+        state.opened_at = None
+        state.last_error = None
+
+    def on_failure(self, key: str, error: str):
+        state = self._state(key)
+        state.failures += 1
+        state.last_error = error
+
+        if state.circuit == CIRCUIT_HALF_OPEN or (
+            state.circuit == CIRCUIT_CLOSED and state.failures >= self._failure_threshold):
+            if state.circuit == CIRCUIT_CLOSED:
+                logging.warning(f"Origin { key } failed { state.failures } connects, circuit open")
+
+            state.circuit = CIRCUIT_OPEN
+            state.opened_at = time.time()
+
+    def states(self) -> Dict[str, OriginState]:
+        return self._origins
+
+    def stats(self) -> Dict[str, int]:
+        stats = { CIRCUIT_CLOSED: 0, CIRCUIT_OPEN: 0, CIRCUIT_HALF_OPEN: 0, "in_flight": self._in_flight }
+        for state in self._origins.values():
+            stats[state.circuit] += 1
+
+        return stats
@@ -1,46 +1,63 @@
 import asyncio
-import logging
 
 from .tcpprotocol import TCPProtocol, TCPConnectionHandler
+from .keepalive import KeepaliveOptions, IdleWheel
 
 
-class TCPClient(TCPConnectionHandler):
+class TCPClient():
     _name: str
     _host: str
     _port: int
 
     _transport: asyncio.Transport
     _proto: TCPProtocol
-    _additional_handler: TCPConnectionHandler
+    _handler: TCPConnectionHandler
+    _keepalive: KeepaliveOptions
+    _idle_wheel: IdleWheel
+    _read_timeout: float
 
     def __init__(
         self,
         name: str,
         host: str,
         port: int,
-        additional_handler: TCPConnectionHandler = None
+        additional_handler: TCPConnectionHandler = None,
+        keepalive: KeepaliveOptions = None,
+        idle_wheel: IdleWheel = None,
+        read_timeout: float = 0
     ) -> None:
         self._name = name
         self._host = host
         self._port = port
-        self._additional_handler = additional_handler
+        # Events go straight from the protocol to the handler
+        self._handler = additional_handler if additional_handler is not None else TCPConnectionHandler()
+        self._keepalive = keepalive
+        self._idle_wheel = idle_wheel
+        self._read_timeout = read_timeout
 
         self._transport = None
         self._proto = None
 
-    async def connect(self) -> bool:
+    async def open(self):
+        # Raises on failure, for callers that want to know why
         if self._transport is not None:
             return
 
         loop = asyncio.get_running_loop()
+        (self._transport, self._proto) = await loop.create_connection(
+            lambda: TCPProtocol(
+                self._handler,
+                keepalive=self._keepalive,
+                idle_wheel=self._idle_wheel,
+                read_timeout=self._read_timeout),
+            self._host,
+            self._port
+        )
 
+    async def connect(self) -> bool:
         try:
-            (self._transport, self._proto) = await loop.create_connection(
-                lambda: TCPProtocol(self),
-                self._host,
-                self._port
-            )
-        except BaseException as e:
+            await self.open()
+        except Exception:
             return False
 
         return True
@@ -64,41 +81,3 @@ class TCPClient(TCPConnectionHandler):
 
     def location(self) -> str:
         return f"{ self._host }:{ self._port }"
-
-    # Handler
-    def on_new_connection(
-        self,
-        id: str,
-        remote_host: str,
-        remote_port: int
-    ):
-        if self._additional_handler is None:
-            return
-
-        self._additional_handler.on_new_connection(
-            id,
-            remote_host,
-            remote_port
-        )
-
-    def on_data_received(
-        self,
-        id: str,
-        data: bytes
-    ):
-        if self._additional_handler is None:
-            return
-
-        self._additional_handler.on_data_received(id, data)
-
-    def on_closed(self, id: str):
-        if self._additional_handler is None:
-            return
-
-        self._additional_handler.on_closed(id)
-
-    def on_sent(self, id: str, num_bytes: int):
-        if self._additional_handler is None:
-            return
-
-        self._additional_handler.on_sent(id, num_bytes)
@@ -1,7 +1,10 @@
 class TCPConnectionHandler:
+    # on_sent costs a call per write, handlers that count bytes set this to get it
+    track_sent: bool = False
+
     def on_new_connection(
         self,
-        id: str,
+        id: int,
         remote_host: str,
         remote_port: int
     ):
@@ -9,13 +12,13 @@ class TCPConnectionHandler:
 
     def on_data_received(
         self,
-        id: str,
+        id: int,
         data: bytes
     ):
         pass
 
-    def on_closed(self, id: str):
+    def on_closed(self, id: int):
         pass
 
-    def on_sent(self, id: str, num_bytes: int):
+    def on_sent(self, id: int, num_bytes: int):
         pass
@@ -1,26 +1,108 @@
 import asyncio
 import logging
-import uuid
-from typing import Tuple
+import itertools
+from typing import Callable, Dict, Tuple
 from .tcpconnectionhandler import TCPConnectionHandler
+from .keepalive import KeepaliveOptions, IdleWheel, set_keepalive
+
+# What to do with data for a peer whose transport buffer is above the high-water mark
+LAG_POLICY_DROP = "drop"
+LAG_POLICY_DISCONNECT = "disconnect"
+LAG_POLICY_COALESCE = "coalesce"
+
+DEFAULT_WRITE_LIMIT = 1024 * 1024
+
+# Connection ids only need to be unique within the process
+_connection_ids = itertools.count(1)
 
 
 class TCPProtocol(asyncio.Protocol):
+    __slots__ = (
+        "_remote_host", "_remote_port", "_transport", "_is_closed", "_id", "_connections",
+        "_on_new_connection", "_on_data_received", "_on_closed", "_on_sent",
+        "_write_limit", "_lag_policy", "_is_paused", "_pending", "_dropped_bytes",
+        "_keepalive", "_wheel", "_read_timeout", "_last_read", "_wheel_slot",
+    )
+
     _remote_host: str
     _remote_port: int
     _transport: asyncio.Transport
     _is_closed: bool
-    _handler: TCPConnectionHandler
-    _id: str
+    _id: int
+    _connections: Dict[int, "TCPProtocol"]
+
+    # Handler methods, bound once so every event is a single call
+    _on_new_connection: Callable[[int, str, int], None]
+    _on_data_received: Callable[[int, bytes], None]
+    _on_closed: Callable[[int], None]
+    _on_sent: Callable[[int, int], None]
+
+    # Flow control
+    _write_limit: int
+    _lag_policy: str
+    _is_paused: bool
+    _pending: bytearray
+    _dropped_bytes: int
+
+    # Liveness
+    _keepalive: KeepaliveOptions
+    _wheel: IdleWheel
+    _read_timeout: float
+    _last_read: float
+    _wheel_slot: int
 
-    def __init__(self, handler: TCPConnectionHandler) -> None:
+    def __init__(
+        self,
+        handler: TCPConnectionHandler,
+        write_limit: int = DEFAULT_WRITE_LIMIT,
+        lag_policy: str = LAG_POLICY_COALESCE,
+        connections: Dict[int, "TCPProtocol"] = None,
+        keepalive: KeepaliveOptions = None,
+        idle_wheel: IdleWheel = None,
+        read_timeout: float = 0
+    ) -> None:
+        if lag_policy not in (LAG_POLICY_DROP, LAG_POLICY_DISCONNECT, LAG_POLICY_COALESCE):
+            raise Exception(f"Unknown lag policy '{ lag_policy }'")
+
+        self._remote_host = None
+        self._remote_port = 0
+        self._transport = None
         self._is_closed = True
-        self._handler = handler
-        self._id = str(uuid.uuid4())
+        self._id = next(_connection_ids)
+
+        # A server passes its table, the protocol joins it on creation and leaves it on close
+        self._connections = connections
+        if connections is not None:
+            connections[self._id] = self
+
+        self._on_new_connection = handler.on_new_connection
+        self._on_data_received = handler.on_data_received
+        self._on_closed = handler.on_closed
+        self._on_sent = handler.on_sent if handler.track_sent else None
+
+        self._write_limit = write_limit
+        self._lag_policy = lag_policy
+        self._is_paused = False
+        self._pending = bytearray()
+        self._dropped_bytes = 0
 
-    def _close(self):
-        self._transport.close()
+        self._keepalive = keepalive
+        self._wheel = idle_wheel if read_timeout > 0 else None
+        self._read_timeout = read_timeout
+        self._last_read = 0.0
+        self._wheel_slot = None
+
+    def _close(self, abort: bool = False):
+        # close() waits for the write buffer to drain, a peer that stopped reading never lets it
+        if abort:
+            self._transport.abort()
+        else:
+            self._transport.close()
         self._is_closed = True
+        self._pending.clear()
+
+        if self._wheel is not None:
+            self._wheel.remove(self)
 
     def connection_made(self, transport: asyncio.Transport):
         # Tuple: (host, port) of remote
@@ -34,17 +116,54 @@ class TCPProtocol(asyncio.Protocol):
         self._transport = transport
         self._is_closed = False
 
-        self._handler.on_new_connection(self._id, host, port)
+        # Transport pauses us once half of the cap is queued, the other half is for coalescing
+        transport.set_write_buffer_limits(high=self._write_limit // 2)
+
+        if self._keepalive is not None:
+            set_keepalive(transport, self._keepalive)
+
+        if self._wheel is not None:
+            self._wheel.add(self)
+
+        self._on_new_connection(self._id, host, port)
 
     def data_received(self, data: bytes):
         # logging.info(f"data_received: { data }")
 
-        self._handler.on_data_received(self._id, data)
+        if self._wheel is not None:
+            self._last_read = self._wheel.now
+
+        self._on_data_received(self._id, data)
 
     def connection_lost(self, exc):
         # logging.info(f"Connection from { self.remote_info() } lost, err: { exc }")
         self._close()
-        self._handler.on_closed(self._id)
+
+        if self._connections is not None:
+            self._connections.pop(self._id, None)
+
+        self._on_closed(self._id)
+
+    def on_read_idle(self):
+        # Called by the wheel, a peer that went quiet this long is treated as gone
+        logging.warning(f"Nothing received from { self.remote_info() } in { self._read_timeout } seconds, closing")
+        self._is_closed = True
+        self._pending.clear()
+        self._transport.abort()
+
+    def pause_writing(self):
+        self._is_paused = True
+
+    def resume_writing(self):
+        self._is_paused = False
+
+        if self._dropped_bytes > 0:
+            logging.warning(f"Peer { self.remote_info() } caught up, { self._dropped_bytes } bytes were dropped")
+            self._dropped_bytes = 0
+
+        if len(self._pending) > 0 and not self._is_closed:
+            self._transport.write(bytes(self._pending))
+            self._pending.clear()
 
     def remote_info(self) -> str:
         return f"{ self._remote_host }:{ self._remote_port }"
@@ -53,8 +172,19 @@ class TCPProtocol(asyncio.Protocol):
         if self._is_closed:
             return
 
-        self._transport.write(data)
-        self._handler.on_sent(self._id, len(data))
+        if not self._is_paused:
+            self._transport.write(data)
+            if self._on_sent is not None:
+                self._on_sent(self._id, len(data))
+            return
+
+        if self._lag_policy == LAG_POLICY_DROP:
+            self._dropped_bytes += len(data)
+        elif self._lag_policy == LAG_POLICY_COALESCE and len(self._pending) + len(data) <= self._write_limit // 2:
+            self._pending += data
+        else:
+            logging.warning(f"Disconnecting lagging peer { self.remote_info() }")
+            self._close(abort=True)
 
     def close(self):
         if not self._is_closed:
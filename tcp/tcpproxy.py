@@ -1,15 +1,21 @@
+import codecs
 import asyncio
 import logging
-from typing import Any, Coroutine, Set
+from typing import Callable, Coroutine, List, Set
 
-from db import Db
+from db import DbWriter
 from .tcpclient import TCPClient
 from .tcpserver import TCPServer
+from .tcpprotocol import DEFAULT_WRITE_LIMIT, LAG_POLICY_COALESCE
 from .tcpconnectionhandler import TCPConnectionHandler
+from .framing import Framer, ChunkFramer, create_decoder
+from .reconnect import ReconnectScheduler
+from .keepalive import KeepaliveOptions, IdleWheel
+from .multiplex import MultiplexServer
 
 
 class TCPProxy(TCPConnectionHandler):
-    _db: Db
+    _writer: DbWriter
     _name: str
     _location: str
     _listen_host: str
@@ -19,6 +25,23 @@ class TCPProxy(TCPConnectionHandler):
 
     _is_auto_connect: bool
     _reconnect_interval: float
+    _scheduler: ReconnectScheduler
+    _client_write_limit: int
+    _lag_policy: str
+    _frame_idle_timeout: float
+    _frame_max_age: float
+    _keepalive: KeepaliveOptions
+    _idle_wheel: IdleWheel
+    _origin_read_timeout: float
+    _client_read_timeout: float
+    _listen: bool
+    _shared_listener: MultiplexServer
+
+    _framer: Framer
+    _decoder: codecs.IncrementalDecoder
+    _last_data_at: float
+    _frame_started_at: float
+    _idle_handle: asyncio.TimerHandle
 
     _origin: TCPClient
     _server: TCPServer
@@ -31,7 +54,7 @@ class TCPProxy(TCPConnectionHandler):
 
     def __init__(
         self,
-        db: Db,
+        writer: DbWriter,
         name: str,
         location: str,
         listen_host: str,
@@ -39,9 +62,21 @@ class TCPProxy(TCPConnectionHandler):
         origin_host: str,
         origin_port: str,
         auto_connect: bool,
-        reconnect_interval: float
+        reconnect_interval: float,
+        client_write_limit: int = DEFAULT_WRITE_LIMIT,
+        lag_policy: str = LAG_POLICY_COALESCE,
+        framer_factory: Callable[[], Framer] = ChunkFramer,
+        frame_idle_timeout: float = 0,
+        frame_max_age: float = 0,
+        reconnect_scheduler: ReconnectScheduler = None,
+        keepalive: KeepaliveOptions = None,
+        idle_wheel: IdleWheel = None,
+        origin_read_timeout: float = 0,
+        client_read_timeout: float = 0,
+        listen: bool = True,
+        shared_listener: MultiplexServer = None
     ) -> None:
-        self._db = db
+        self._writer = writer
         self._name = name
         self._location = location
         self._listen_host = listen_host
@@ -50,6 +85,23 @@ class TCPProxy(TCPConnectionHandler):
         self._origin_port = origin_port
         self._is_auto_connect = auto_connect
         self._reconnect_interval = reconnect_interval
+        self._scheduler = reconnect_scheduler if reconnect_scheduler is not None else ReconnectScheduler()
+        self._client_write_limit = client_write_limit
+        self._lag_policy = lag_policy
+        self._frame_idle_timeout = frame_idle_timeout
+        self._frame_max_age = frame_max_age
+        self._keepalive = keepalive
+        self._idle_wheel = idle_wheel
+        self._origin_read_timeout = origin_read_timeout
+        self._client_read_timeout = client_read_timeout
+        self._listen = listen
+        self._shared_listener = shared_listener
+
+        self._framer = framer_factory()
+        self._decoder = create_decoder()
+        self._last_data_at = 0.0
+        self._frame_started_at = 0.0
+        self._idle_handle = None
 
         self._origin = None
         self._server = None
@@ -64,11 +116,14 @@ class TCPProxy(TCPConnectionHandler):
             f"{ self._name } origin",
             self._origin_host,
             self._origin_port,
-            self
+            self,
+            keepalive=self._keepalive,
+            idle_wheel=self._idle_wheel,
+            read_timeout=self._origin_read_timeout
         )
 
         logging.info(f"Connecting to '{ self._origin.name() }' ({ self._origin.location() })")
-        ret = await self._origin.connect()
+        ret = await self._scheduler.connect(self._origin.location(), self._origin.open)
         self._is_connected = ret
 
         if not ret:
@@ -76,16 +131,6 @@ class TCPProxy(TCPConnectionHandler):
 
         return ret
 
-    async def _keep_alive(self):
-        while True:
-            await asyncio.sleep(60)
-
-            logging.info(f"Sending keep-alive messages...")
-            if self._is_connected:
-                await self._origin.send(b"\0")
-
-            await self._server.send(b"\0")
-
     async def _schedule_reconnect_origin(self):
         # If already have reconnect pending ...
         if self._reconnect_task is not None:
@@ -101,12 +146,45 @@ class TCPProxy(TCPConnectionHandler):
         self._reconnect_task.add_done_callback(self._async_callback_result)
 
     async def _reconnect_origin(self):
-        logging.info(f"Scheduled to reconnect in { self._reconnect_interval } seconds ...")
-        await asyncio.sleep(self._reconnect_interval)
+        # Backoff and jitter are per origin, proxies of a site that went down do not retry together
+        delay = self._scheduler.delay(f"{ self._origin_host }:{ self._origin_port }", self._reconnect_interval)
+        logging.info(f"Scheduled to reconnect '{ self._name }' in { round(delay, 1) } seconds ...")
+        await asyncio.sleep(delay)
         await self.connect_origin()
 
+    async def retarget(
+        self,
+        location: str,
+        origin_host: str,
+        origin_port: int,
+        auto_connect: bool,
+        reconnect_interval: float
+    ) -> None:
+        was_auto_connect = self._is_auto_connect
+
+        self._location = location
+        self._is_auto_connect = auto_connect
+        self._reconnect_interval = reconnect_interval
+
+        if (origin_host, origin_port) != (self._origin_host, self._origin_port):
+            logging.info(f"Retargeting '{ self._name }' to { origin_host }:{ origin_port }")
+            self._origin_host = origin_host
+            self._origin_port = origin_port
+
+            # Dropping the old session reconnects through on_closed, the listener and its clients stay up.
+            # A pending reconnect picks up the new origin by itself.
+            if self._origin is not None and self._is_connected:
+                await self._origin.close()
+
+            return
+
+        reconnect_pending = self._reconnect_task is not None and not self._reconnect_task.done()
+        if auto_connect and not was_auto_connect and self._origin is None and not reconnect_pending:
+            await self.connect_origin()
+
     async def reset_origin(self, is_force: bool = False) -> None:
         self._origin = None
+        self._is_connected = False
 
         if not is_force:
             await self._schedule_reconnect_origin()
@@ -115,7 +193,12 @@ class TCPProxy(TCPConnectionHandler):
         self._server = TCPServer(
             f"{ self._name } server",
             self._listen_host,
-            self._listen_port
+            self._listen_port,
+            write_limit=self._client_write_limit,
+            lag_policy=self._lag_policy,
+            keepalive=self._keepalive,
+            idle_wheel=self._idle_wheel,
+            read_timeout=self._client_read_timeout
         )
 
         if not await self._server.start():
@@ -139,22 +222,29 @@ class TCPProxy(TCPConnectionHandler):
             pass
 
     async def start(self) -> bool:
-        if not await self._start_server():
+        # With a shared listener the proxy's own port is optional
+        if self._listen and not await self._start_server():
             return False
 
+        if self._shared_listener is not None:
+            self._shared_listener.register(self._name)
+
         if self._is_auto_connect:
             await self.connect_origin()
 
-        task = asyncio.create_task(self._keep_alive())
-        task.add_done_callback(self._remove_task_from_set)
-        self._additional_tasks.add(task)
-
     async def stop(self) -> None:
         logging.info(f"Stopping proxy '{ self._name }'")
         self._pending_close = True
 
+        if self._shared_listener is not None:
+            self._shared_listener.unregister(self._name)
+
         await self._reset_server()
 
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
         if self._reconnect_task is not None:
             if not self._reconnect_task.done():
                 self._reconnect_task.cancel()
@@ -205,41 +295,104 @@ class TCPProxy(TCPConnectionHandler):
 
     def on_new_connection(
         self,
-        id: str,
+        id: int,
         remote_host: str,
         remote_port: int
     ):
         logging.debug(f"New connection { id } from { remote_host }:{ remote_port }")
 
-        if self._server is None:
-            return
+        # Nothing buffered from a previous session belongs to this one
+        self._framer.reset()
+        self._decoder.reset()
 
-        self.invoke_async_func(self._server.send(f"'{ self._name }' origin connected\r\n".encode()))
+        self._notify("connected")
 
-    def on_closed(self, id: str):
+    def on_closed(self, id: int):
         logging.debug(f"Connection closed: { id }")
+        self._is_connected = False
+
+        # The last message may have no terminator, the end of the session completes it
+        self._on_frames(self._framer.flush())
+
         if self._pending_close:
             return
 
         self.invoke_async_func(self.reset_origin())
 
-        if self._server is None:
-            return
+        self._notify("disconnected")
+
+    def _notify(self, event: str):
+        if self._server is not None:
+            self._server.send(f"'{ self._name }' origin { event }\r\n".encode())
 
-        self.invoke_async_func(self._server.send(f"'{ self._name }' origin disconnected\r\n".encode()))
+        if self._shared_listener is not None:
+            self._shared_listener.publish_event(self._name, event)
 
     def on_data_received(
         self,
-        id: str,
+        id: int,
         data: bytes
     ):
-        try:
-            self._db.save_pos(self._name, data.decode(), self._location, )
-        except:
-            logging.exception(f"Failed to save data received '{ self._name }'")
+        was_pending = self._framer.pending()
+        frames = self._framer.feed(data)
+        self._on_frames(frames)
+
+        if (self._frame_idle_timeout > 0 or self._frame_max_age > 0) and self._framer.pending():
+            loop = asyncio.get_running_loop()
+            self._last_data_at = loop.time()
+
+            # What is buffered now started in this segment
+            if not was_pending or len(frames) > 0:
+                self._frame_started_at = self._last_data_at
+
+            # One timer per quiet period, not one per segment
+            if self._idle_handle is None:
+                self._idle_handle = loop.call_at(self._frame_deadline(), self._on_frame_idle)
+
+    def _frame_deadline(self) -> float:
+        # A quiet period ends the frame, and so does its age, for origins that never go quiet
+        deadlines = []
+        if self._frame_idle_timeout > 0:
+            deadlines.append(self._last_data_at + self._frame_idle_timeout)
+        if self._frame_max_age > 0:
+            deadlines.append(self._frame_started_at + self._frame_max_age)
+
+        return min(deadlines)
+
+    def _on_frame_idle(self):
+        self._idle_handle = None
+        if not self._framer.pending():
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = self._frame_deadline()
+        if deadline > loop.time():
+            self._idle_handle = loop.call_at(deadline, self._on_frame_idle)
+            return
+
+        self._on_frames(self._framer.flush())
+
+    def _on_frames(self, frames: List[bytes]):
+        if len(frames) == 0:
+            return
+
+        for frame in frames:
+            try:
+                self._writer.save_pos(self._name, self._decoder.decode(self._framer.payload(frame)), self._location)
+            except:
+                logging.exception(f"Failed to save data received '{ self._name }'")
+
+        if self._server is None and self._shared_listener is None:
+            return
 
         try:
-            self.invoke_async_func(self._server.send(data))
+            if self._server is not None:
+                self._server.send(frames[0] if len(frames) == 1 else b"".join(frames))
+
+            # Shared listener clients get one tagged message per frame
+            if self._shared_listener is not None:
+                for frame in frames:
+                    self._shared_listener.publish(self._name, frame)
         except:
             logging.exception(f"Failed to forward data received '{ self._name }'")
 
@@ -1,19 +1,25 @@
 import asyncio
 import logging
-from typing import Set
+from typing import Dict
 
-from .tcpprotocol import TCPProtocol
+from .tcpprotocol import TCPProtocol, DEFAULT_WRITE_LIMIT, LAG_POLICY_COALESCE
 from .tcpconnectionhandler import TCPConnectionHandler
+from .keepalive import KeepaliveOptions, IdleWheel
 
 
-class TCPServer(TCPConnectionHandler):
+class TCPServer():
     _name: str
     _host: str
     _port: int
-    _additional_handler: TCPConnectionHandler
+    _handler: TCPConnectionHandler
+    _write_limit: int
+    _lag_policy: str
+    _keepalive: KeepaliveOptions
+    _idle_wheel: IdleWheel
+    _read_timeout: float
 
     # Internal
-    _protos: Set[TCPProtocol]
+    _protos: Dict[int, TCPProtocol]
     _accept_task: asyncio.Task
 
     def __init__(
@@ -21,22 +27,37 @@ class TCPServer(TCPConnectionHandler):
         name: str,
         host: str,
         port: int,
-        additional_handler: TCPConnectionHandler = None
+        additional_handler: TCPConnectionHandler = None,
+        write_limit: int = DEFAULT_WRITE_LIMIT,
+        lag_policy: str = LAG_POLICY_COALESCE,
+        keepalive: KeepaliveOptions = None,
+        idle_wheel: IdleWheel = None,
+        read_timeout: float = 0
     ) -> None:
         self._name = name
         self._host = host
         self._port = port
-        self._additional_handler = additional_handler
+        # Events go straight from the protocols to the handler
+        self._handler = additional_handler if additional_handler is not None else TCPConnectionHandler()
+        self._write_limit = write_limit
+        self._lag_policy = lag_policy
+        self._keepalive = keepalive
+        self._idle_wheel = idle_wheel
+        self._read_timeout = read_timeout
 
         # Internal
-        self._protos = set()
+        self._protos = dict()
         self._accept_task = None
 
     def _protocol_factory(self):
-        proto = TCPProtocol(self)
-        self._protos.add(proto)
-
-        return proto
+        return TCPProtocol(
+            self._handler,
+            self._write_limit,
+            self._lag_policy,
+            self._protos,
+            self._keepalive,
+            self._idle_wheel,
+            self._read_timeout)
 
     async def start(self) -> bool:
         loop = asyncio.get_running_loop()
@@ -69,53 +90,26 @@ class TCPServer(TCPConnectionHandler):
                 pass
 
         # Close remaing connections
-        for proto in self._protos:
+        for proto in list(self._protos.values()):
             proto.close()
 
         self._accept_task = None
         self._protos.clear()
 
-    async def send(self, data: bytes):
-        for proto in self._protos:
+    def send(self, data: bytes):
+        # The same buffer is handed to every transport, nothing is copied per client
+        for proto in self._protos.values():
             proto.send(data)
 
-    def name(self) -> str:
-        return self._name
-
-    # Handler
-    def on_new_connection(
-        self,
-        id: str,
-        remote_host: str,
-        remote_port: int
-    ):
-        if self._additional_handler is None:
-            return
-
-        # logging.info(f"New connection to Proxy Server { self._name } (id: '{ id }', remote_host: '{ remote_host }', remote_port: '{ remote_port }')")
-        self._additional_handler.on_new_connection(id, remote_host, remote_port)
-
-    def on_data_received(
-        self,
-        id: str,
-        data: bytes
-    ):
-        if self._additional_handler is None:
-            return
-
-        # logging.info(f"Proxy Server { self._name } received data (id: '{ id }', data: '{ data }')")
-        self._additional_handler.on_data_received(id, data)
-
-    def on_closed(self, id: str):
-        if self._additional_handler is None:
-            return
-
-        # logging.info(f"Proxy Server  { self._name } closed connection (id: '{ id }')")
-        self._additional_handler.on_closed(id)
+    def send_to(self, id: int, data: bytes):
+        proto = self._protos.get(id)
+        if proto is not None:
+            proto.send(data)
 
-    def on_sent(self, id: str, num_bytes: int):
-        if self._additional_handler is None:
-            return
+    def close(self, id: int):
+        proto = self._protos.get(id)
+        if proto is not None:
+            proto.close()
 
-        # logging.info(f"on_sent(id: '{ id }', num_bytes: '{ num_bytes }')")
-        self._additional_handler.on_sent(id, num_bytes)
\ No newline at end of file
+    def name(self) -> str:
+        return self._name
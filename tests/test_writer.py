@@ -0,0 +1,124 @@
+import os
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db.writer import DbWriter, POLICY_SPILL
+from db.shards import shard_path
+
+
+def make_rows(count: int, prefix: str):
+    return [
+        {
+            "source": "ST01",
+            "content": f"{ prefix } { i }",
+            "location": "site",
+            "created_at": datetime(2026, 10, 17, 12, 0, i)
+        }
+        for i in range(count)
+    ]
+
+
+def test_spilled_rows_are_replayed_after_a_failed_commit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    writer = DbWriter(policy=POLICY_SPILL, spill_path="spill/pos_data.jsonl")
+
+    commit = Session.commit
+    def failing_commit(self):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(Session, "commit", failing_commit)
+    failed = make_rows(3, "failed")
+    assert not writer._flush(failed)
+    monkeypatch.setattr(Session, "commit", commit)
+
+    assert all("id" not in row for row in failed)
+    assert writer.stats().spilled == 3
+
+    # The rolled back ids are handed out again in the meantime
+    saved = make_rows(3, "saved")
+    assert writer._flush(saved)
+    assert [ "id" in row for row in saved ] == [ True ] * 3
+
+    writer._replay_at = 0
+    writer._replay_spill()
+
+    assert writer.stats().spilled == 3
+    assert writer.stats().written == 6
+    assert not os.path.exists("spill/pos_data.jsonl")
+    assert not os.path.exists("spill/pos_data.jsonl.replay")
+
+    sessions = writer._shards._session_for(datetime(2026, 10, 17).date(), create=False)
+    with sessions() as db:
+        contents = db.execute(text("SELECT content FROM pos_data ORDER BY id")).scalars().all()
+
+    assert sorted(contents) == sorted([ f"failed { i }" for i in range(3) ] + [ f"saved { i }" for i in range(3) ])
+
+
+def test_a_batch_over_two_days_spills_only_the_failed_day(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    writer = DbWriter(policy=POLICY_SPILL, spill_path="spill/pos_data.jsonl")
+
+    first_day = make_rows(2, "first")
+    second_day = [ { **row, "created_at": row["created_at"].replace(day=18) } for row in make_rows(2, "second") ]
+
+    commit = Session.commit
+    calls = []
+    def second_commit_fails(self):
+        calls.append(self)
+        if len(calls) == 2:
+            raise RuntimeError("disk I/O error")
+        commit(self)
+
+    monkeypatch.setattr(Session, "commit", second_commit_fails)
+    assert not writer._flush(first_day + second_day)
+    monkeypatch.setattr(Session, "commit", commit)
+
+    assert writer.stats().written == 2
+    assert writer.stats().spilled == 2
+
+    with open("spill/pos_data.jsonl", "rt") as fp:
+        assert [ "second" in line for line in fp ] == [ True, True ]
+
+
+def test_a_full_queue_spills_on_the_writer_thread(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    writer = DbWriter(max_queue=2, policy=POLICY_SPILL, spill_path="spill/pos_data.jsonl")
+    for row in make_rows(4, "row"):
+        writer.put(row)
+
+    # Producers only hand the rows over
+    assert not os.path.exists("spill/pos_data.jsonl")
+
+    writer._spill_overflow()
+    assert writer.stats().spilled == 2
+    with open("spill/pos_data.jsonl", "rt") as fp:
+        assert len(fp.readlines()) == 2
+
+
+def test_a_failed_replay_keeps_the_replay_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    writer = DbWriter(batch_size=2, policy=POLICY_SPILL, spill_path="spill/pos_data.jsonl")
+    writer._spill(make_rows(4, "row"))
+
+    def failing_commit(self):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(Session, "commit", failing_commit)
+    writer._replay_spill()
+
+    with open("spill/pos_data.jsonl.replay", "rt") as fp:
+        assert len(fp.readlines()) == 4
+    assert writer.stats().spilled == 4
+
+    # A replay file it can't read is logged and kept, not raised on the writer thread
+    with open("spill/pos_data.jsonl.replay", "at") as fp:
+        fp.write("{ truncated")
+
+    writer._replay_at = 0
+    writer._replay_spill()
+    assert os.path.exists("spill/pos_data.jsonl.replay")
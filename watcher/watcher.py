@@ -1,33 +1,146 @@
+import os
+import gzip
+import time
+import shutil
 import sqlite3
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
+
+from db import list_shard_days, shard_path
+from db.database import BUSY_TIMEOUT_IN_SECONDS
+
+DB_PATH = "collection.sqlite3"
+BACKUP_DIR = "backup"
+
+# Rows removed per purge transaction, keeps the write lock short for the ingest processes
+PURGE_CHUNK_SIZE = 5000
 
 class Watcher():
-    def __init__(self):
-        self._last_check = datetime.now()
+    _compress: bool
+    _pages_per_step: int
+    _retention_days: int
+    _last_progress: int
 
-    def get_scheduled_time(self) -> datetime:
+    def __init__(self, compress: bool = True, pages_per_step: int = 1024, retention_days: int = 7):
+        self._compress = compress
+        self._pages_per_step = pages_per_step
+        self._retention_days = retention_days
+        self._last_progress = -1
+
+    def get_scheduled_time(self, now: datetime) -> datetime:
         with open("watcher.txt", "rt") as fp:
             parts = fp.read().strip().split(':')
 
-        now = datetime.now()
         return datetime(now.year, now.month, now.day, int(parts[0]), int(parts[1]), 0)
 
-    def check_schedule(self):
-        rtime = self.get_scheduled_time()
+    def next_run(self, now: datetime) -> datetime:
+        rtime = self.get_scheduled_time(now)
+        if rtime <= now:
+            rtime += timedelta(days=1)
 
-        now = datetime.now()
-        if self._last_check < rtime and now > rtime:
-            conn = sqlite3.connect('collection.sqlite3')
-            save_date = now.strftime("%d-%b-%Y-%H-%M")
-
-            with open(f"backup/{save_date}.sql", "w") as dump_file:
-                for line in conn.iterdump():
-                    dump_file.write('%s\n' % line)
-
-            conn.execute("DELETE FROM pos_data")
-            conn.commit()
-            conn.execute("VACUUM")
-            conn.commit()
+        return rtime
+
+    def _progress(self, status: int, remaining: int, total: int):
+        percent = 100 * (total - remaining) // max(total, 1)
+        if percent // 10 != self._last_progress // 10:
+            logging.info(f"Backup { percent }% ({ total - remaining }/{ total } pages)")
+            self._last_progress = percent
+
+    def backup(self, path: str) -> int:
+        src = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_IN_SECONDS, isolation_level=None)
+        dst = sqlite3.connect(path)
+
+        try:
+            # Pins one WAL snapshot for the whole copy, writers carry on meanwhile
+            src.execute("BEGIN")
+            (max_id, ) = src.execute("SELECT COALESCE(MAX(id), 0) FROM pos_data").fetchone()
+
+            self._last_progress = -1
+            src.backup(dst, pages=self._pages_per_step, progress=self._progress)
+            src.execute("COMMIT")
+        finally:
+            dst.close()
+            src.close()
+
+        return max_id
+
+    def _compress_file(self, path: str) -> str:
+        compressed_path = f"{ path }.gz"
+
+        with open(path, "rb") as fp, gzip.open(compressed_path, "wb") as gz:
+            shutil.copyfileobj(fp, gz, 1024 * 1024)
+
+        os.remove(path)
+        return compressed_path
+
+    def purge(self, max_id: int):
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_IN_SECONDS)
+        deleted = 0
+
+        try:
+            while True:
+                cursor = conn.execute(
+                    "DELETE FROM pos_data WHERE id IN (SELECT id FROM pos_data WHERE id <= ? LIMIT ?)",
+                    (max_id, PURGE_CHUNK_SIZE))
+                conn.commit()
+
+                deleted += cursor.rowcount
+                if cursor.rowcount < PURGE_CHUNK_SIZE:
+                    break
+
+                # Lets the writers of the other processes take the lock in between
+                time.sleep(0.01)
+        finally:
             conn.close()
 
-        self._last_check = now
\ No newline at end of file
+        logging.info(f"Purged { deleted } rows")
+
+    def expire_shards(self, today: datetime):
+        cutoff = today.date() - timedelta(days=self._retention_days)
+
+        for day in list_shard_days():
+            if day >= cutoff:
+                continue
+
+            path = shard_path(day)
+            target = os.path.join(BACKUP_DIR, os.path.basename(path))
+
+            try:
+                # Folds the WAL into the file, a closed shard is then a single file to move
+                conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_IN_SECONDS)
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                conn.execute("PRAGMA journal_mode=DELETE")
+                conn.close()
+
+                os.replace(path, target)
+            except (OSError, sqlite3.Error) as e:
+                # Still opened by another process, retried on the next run
+                logging.warning(f"Can't expire shard '{ path }': { e }")
+                continue
+
+            if self._compress:
+                target = self._compress_file(target)
+
+            logging.info(f"Shard { day } moved to '{ target }'")
+
+    def run(self):
+        logging.info("Running scheduled backup")
+
+        now = datetime.now()
+        save_date = now.strftime("%d-%b-%Y-%H-%M")
+        path = os.path.join(BACKUP_DIR, f"{save_date}.sqlite3")
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+
+        started = time.monotonic()
+        max_id = self.backup(path)
+
+        if self._compress:
+            path = self._compress_file(path)
+
+        logging.info(f"Backup written to '{ path }' in { time.monotonic() - started:.1f}s")
+
+        # Only rows contained in the backup are removed, newer ones stay.
+        # pos_data in the main file only holds rows from before the daily shards.
+        self.purge(max_id)
+
+        self.expire_shards(now)
@@ -1,27 +1,36 @@
 import os
 import re
 import sys
+import time
 import asyncio
+import hashlib
 import logging
+import threading
 import uvicorn
-from db import Db
+from db import Db, MAX_PAGE_SIZE
+from sqlalchemy.exc import IntegrityError
 from conf import Conf
+from bus import Bus, Hub, StationCache, StationFeed, Subscription, expand_batch
+from assets import AssetStore
 import logging.handlers
 from yaml import load, dump
 import multiprocessing as mp
 from jose import jwt, JWTError
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from typing import Dict, Set, Union
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set, Tuple, Union
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import FileResponse
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import FastAPI, WebSocket, Request, Response
+from starlette.datastructures import Headers
+from fastapi import FastAPI, WebSocket, Request, Response, Query
 from fastapi import FastAPI, HTTPException, status, Security
 
 from yaml import load, dump
@@ -30,43 +39,109 @@ try:
 except ImportError:
     from yaml import Loader
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything that touches conf.yaml or SQLite happens here, so importing the module stays cheap
+    global conf
+    global sqlite_db
+    global read_db
+    global db_executor
+    global use_station_cache
 
-sqlite_db: Db = Db()
+    conf = Conf("conf.yaml")
+    LOCAL_HOSTS.add(conf.get_agent_host())
+    db_executor = ThreadPoolExecutor(max_workers=conf.get_web().db_threads, thread_name_prefix="web-db")
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
+    sqlite_db = await run_db(Db)
+    read_db = await run_db(Db, True)
+    await run_db(create_admin_user)
+    await asyncio.get_running_loop().run_in_executor(None, asset_store.load)
 
-        if str(request.url.path).find("/api/") < 0:
-            return await call_next(request) 
-        
-        # The paths to exclude from the middleware
-        EXCLUDE_PATHS_RE = re.compile(r'^/api/(login|register)$')
-        
-        if EXCLUDE_PATHS_RE.match(str(request.url.path)):
-            return await call_next(request)   
-        
-        if str(request.url.path).find("stationdata") > 0 or str(request.url.path).find("samba") > 0:
-            return await call_next(request)
+    # Workers only see part of the pushed rows, so only a single worker may answer from memory
+    use_station_cache = int(os.getenv(WEB_WORKERS_ENV, "1")) == 1
 
+    log_bus.start(log_queue)
+    feed_bus.start(feed_queue)
+
+    yield
+
+    log_bus.stop()
+    feed_bus.stop()
+    db_executor.shutdown(wait=False)
+
+app = FastAPI(lifespan=lifespan)
+
+conf: Conf = None
+
+sqlite_db: Db = None
+
+# Station history is served from query-only connections
+read_db: Db = None
+
+# SQLite calls are blocking, they run here instead of on the event loop
+db_executor: ThreadPoolExecutor = None
+
+# Tells uvicorn's worker processes how many of them there are
+WEB_WORKERS_ENV = "WEB_WORKERS"
+
+async def run_db(fn: Callable, *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+
+# The paths to exclude from the middleware
+EXCLUDE_PATHS_RE = re.compile(r'^/api/(login|register|push_log|push_feed)$')
+
+class AuthMiddleware():
+    # Plain ASGI, BaseHTTPMiddleware would wrap every request and response in extra tasks
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.requires_auth(scope["path"]):
+            return await self.app(scope, receive, send)
+
+        response = await self.check(Headers(scope=scope).get('authorization'))
+        if response is not None:
+            return await response(scope, receive, send)
+
+        await self.app(scope, receive, send)
+
+    def requires_auth(self, path: str) -> bool:
+        if path.find("/api/") < 0:
+            return False
+
+        if EXCLUDE_PATHS_RE.match(path):
+            return False
+
+        if path.find("stationdata") > 0 or path.find("samba") > 0:
+            return False
+
+        return True
+
+    async def check(self, token: str | None) -> JSONResponse | None:
         try:
-            token = request.headers.get('authorization')
             if token is None:
                 return JSONResponse(status_code=401, content={'detail': 'Not authenticated'})
             if token.startswith("Bearer "):
                 token = token[7:]
             else:
                 return JSONResponse(status_code=401, content={'detail': 'Invalid token type'})
-            
-            get_current_user(token)
 
-            return await call_next(request)
-        
+            user_email = verify_token(token)
+
+            # A cache miss goes to SQLite on the DB threads, a hit costs a dict lookup
+            db_user = cached_user(user_email)
+            if db_user is None:
+                db_user = await run_db(get_user_cached, user_email)
+
+            check_user(db_user)
+
+            return None
+
         except HTTPException as e:
             return JSONResponse(status_code=e.status_code, content={'detail': e.detail})
         except Exception as e:
             return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={'detail': str(e)})
-        
+
 origins = [
     "http://localhost:3000",
 ]
@@ -118,7 +193,54 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+class LruCache():
+    # Used from the event loop and from the DB threads alike
+    _size: int
+    _entries: "OrderedDict[str, Any]"
+    _lock: threading.Lock
+
+    def __init__(self, size: int):
+        self._size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+
+            return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+# Verified tokens by hash, each one only until its own "exp"
+token_cache: LruCache = LruCache(1024)
+
+# Enabled users by email, dropped whenever this process changes a user. Accounts are also
+# enabled and disabled outside this process, so entries expire and disabled users are never kept.
+user_cache: LruCache = LruCache(256)
+USER_CACHE_TTL_IN_SECONDS = 60
+
 def verify_token(token: str) -> bool:
+    key = hashlib.sha256(token.encode()).hexdigest()
+    cached: Tuple[str, float] = token_cache.get(key)
+    if cached is not None:
+        (user_email, expires_at) = cached
+        if time.time() < expires_at:
+            return user_email
+
+        token_cache.pop(key)
+
     exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -129,30 +251,60 @@ def verify_token(token: str) -> bool:
         user_email = payload.get("sub")
         if user_email is None:
             raise exception
+        if payload.get("exp") is not None:
+            token_cache.put(key, (user_email, float(payload["exp"])))
         return user_email
     except JWTError:
         raise exception
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(token: str = Security(oauth2_scheme)):
-    user_email = verify_token(token)
-    db_user = sqlite_db.get_user(user_email)
+def cached_user(email: str):
+    cached: Tuple[Any, float] = user_cache.get(email)
+    if cached is None:
+        return None
+
+    (db_user, expires_at) = cached
+    if time.monotonic() >= expires_at:
+        user_cache.pop(email)
+        return None
+
+    return db_user
 
+def get_user_cached(email: str):
+    db_user = cached_user(email)
+    if db_user is None:
+        db_user = sqlite_db.get_user(email)
+        if db_user is not None and db_user.disabled is not True:
+            user_cache.put(email, (db_user, time.monotonic() + USER_CACHE_TTL_IN_SECONDS))
+
+    return db_user
+
+def check_user(db_user):
     if db_user.disabled is True:
         raise HTTPException(status_code=400, detail="Your account is disabled.")
-    
+
+def get_current_user(token: str = Security(oauth2_scheme)):
+    user_email = verify_token(token)
+    db_user = get_user_cached(user_email)
+    check_user(db_user)
+
     return db_user
 
-admin_user = sqlite_db.get_user("development@aigsg.com")
+def create_admin_user():
+    admin_user = sqlite_db.get_user("development@aigsg.com")
 
-if admin_user is None:
-    sqlite_db.save_user(
-        email=os.getenv("ADMIN_EMAIL"),
-        username=os.getenv("ADMIN_USERNAME"),
-        hashed_password=get_password_hash(os.getenv("ADMIN_PASSWORD")),
-        disabled=False,
-    )
+    if admin_user is None:
+        try:
+            sqlite_db.save_user(
+                email=os.getenv("ADMIN_EMAIL"),
+                username=os.getenv("ADMIN_USERNAME"),
+                hashed_password=get_password_hash(os.getenv("ADMIN_PASSWORD")),
+                disabled=False,
+            )
+        except IntegrityError:
+            # Another worker created it first
+            pass
 
 class UnicornException(Exception):
     def __init__(self, name: str):
@@ -178,18 +330,34 @@ async def unicorn_exception_handler(request: Request, exc: UnicornException):
         content={"message": "The request has an invalid URL format"},
     )
 
-conf = Conf("conf.yaml")
-
 app_queue: mp.Queue = None
-log_queues: Set[asyncio.Queue] = set()
+LOCAL_HOSTS: Set[str] = { "127.0.0.1", "::1", "localhost" }
+log_queue: mp.Queue = None
+log_hub: Hub = Hub()
+log_bus: Bus = Bus("log", lambda obj: log_hub.publish_many(expand_batch(obj)))
+
+# Recent rows per station, fed by the services as they save them
+feed_queue: mp.Queue = None
+station_cache: StationCache = StationCache()
+use_station_cache: bool = True
+station_feed: StationFeed = StationFeed()
+
+def on_feed(obj: Dict):
+    if obj.get("dropped", 0) > 0:
+        station_cache.reset()
+
+    rows = obj.get("messages", [])
+    station_cache.add_many(rows)
+    station_feed.publish_many(rows)
+
+feed_bus: Bus = Bus("feed", on_feed)
 
 class RegisterForm(BaseModel):
     username: str
     email: str
     password: str
 
-@app.post("/api/register")
-async def register_user(user: RegisterForm):
+def register(user: RegisterForm):
     db_user = sqlite_db.get_user(user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -199,6 +367,11 @@ async def register_user(user: RegisterForm):
         email=user.email,
         hashed_password=get_password_hash(user.password)
     )
+    user_cache.pop(user.email)
+
+@app.post("/api/register")
+async def register_user(user: RegisterForm):
+    await run_db(register, user)
     return {"msg": "Registration successful!"}
 
 class LoginForm(BaseModel):
@@ -207,7 +380,8 @@ class LoginForm(BaseModel):
 
 @app.post("/api/login")
 async def login_user(credential: LoginForm):
-    user = authenticate_user(credential.email, credential.password)
+    # bcrypt and the user lookup both block, neither runs on the event loop
+    user = await run_db(authenticate_user, credential.email, credential.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -218,8 +392,16 @@ async def login_user(credential: LoginForm):
     access_token = create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
+def page_cursors(records) -> Dict:
+    # Pass "Before" to page towards older rows and "After" to poll for newer ones
+    ids = [ record["Id"] for record in records ]
+    if len(ids) == 0:
+        return { "before": None, "after": None }
+
+    return { "before": min(ids), "after": max(ids) }
+
 @app.get("/api/stationdata/{station_id}")
-async def get_station_data(request: Request, station_id: str = "", From: Union[str, None] = None):
+async def get_station_data(request: Request, station_id: str = "", From: Union[str, None] = None, After: Union[int, None] = None, Before: Union[int, None] = None, Limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
     logging.basicConfig(
             format="[%(asctime)s] %(message)s",
             level=logging.INFO,
@@ -234,7 +416,12 @@ async def get_station_data(request: Request, station_id: str = "", From: Union[s
     if From == None: 
         raise UnicornException(name="WrongURL")
     
-    result  = Db().get_pos(station_id,From)
+    # Live polling is answered from memory, older pages and cold caches go to SQLite
+    result = None
+    if Before is None and use_station_cache:
+        result = station_cache.recent(station_id, From, After, Limit)
+    if result is None:
+        result = await run_db(read_db.get_pos, station_id, From, After, Before, Limit)
 
     clientIP = request.client.host
     serverIP = conf.get_agent_host()
@@ -242,13 +429,19 @@ async def get_station_data(request: Request, station_id: str = "", From: Union[s
 
     url = serverIP + ":" + str(serverPort) + "/api/stationdata/" + station_id + "?From=" + From
     logging.info(clientIP + "---->" + url)
-    return { "data": result }
+    return { "data": result, **page_cursors(result) }
 
 @app.get("/api/samba/{samba_id}")
-async def get_samba_data(request: Request, samba_id: str = "", From: Union[str, None] = None):
+async def get_samba_data(request: Request, samba_id: str = "", From: Union[str, None] = None, After: Union[int, None] = None, Before: Union[int, None] = None, Limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)):
     if From == None: raise UnicornException(name="WrongURL")
     
-    result  = Db().get_samba(samba_id,From)
+    result = None
+    if Before is None and use_station_cache:
+        result = station_cache.recent(samba_id, From, After, Limit)
+        if result is not None:
+            result.sort(key=lambda record: record["TimeStamp"])
+    if result is None:
+        result = await run_db(read_db.get_samba, samba_id, From, After, Before, Limit)
 
     logging.basicConfig(
             format="[%(asctime)s] %(message)s",
@@ -268,32 +461,19 @@ async def get_samba_data(request: Request, samba_id: str = "", From: Union[str,
     url = serverIP + ":" + str(serverPort) + "/api/samba/" + samba_id + "?From=" + From
     logging.info(clientIP + "---->" + url)
 
-    return {"data": result}
+    return {"data": result, **page_cursors(result)}
 
 def do_push_log(obj: Dict):
-    global log_queues
-
-    for queue in log_queues:
-        try:
-            queue.put_nowait(obj)
-        except:
-            pass
+    log_bus.publish(obj)
 
 def root_dir():
     return os.path.abspath(os.path.join(os.path.dirname(__file__), "config"))
 
-def get_resource(path):
-    mimetypes = {
-        ".css": "text/css",
-        ".html": "text/html",
-        ".js": "application/javascript",
-        ".png": "image/png"
-    }
-    complete_path = os.path.join(root_dir(), path)
-    ext = os.path.splitext(path)[1]
-    mimetype = mimetypes.get(ext, "text/html")
-    with open(complete_path, "rb") as fp:
-        return Response(content=fp.read(), media_type=mimetype)
+# The dashboard build, read and compressed once at startup
+asset_store: AssetStore = AssetStore(root_dir())
+
+def get_resource(request: Request, path: str) -> Response:
+    return asset_store.response(path, request.headers)
 
 @app.get("/api/download-sambalog")
 async def download_applog():
@@ -323,29 +503,45 @@ async def get_cfg():
 
 @app.post("/api/cfg")
 async def set_cfg(body: Dict):
-    with open("conf.yaml", "wt") as fp:
+    # Written aside and renamed, so the proxy service never reads a half-written file
+    with open("conf.yaml.tmp", "wt") as fp:
         dump(body, fp)
+    os.replace("conf.yaml.tmp", "conf.yaml")
 
     return {}
 
 @app.post("/api/push_log")
-async def push_log(body: Dict):
+async def push_log(request: Request, body: Dict):
+    # Only the local samba/proxy services ship logs, the route skips authentication
+    if request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
     do_push_log(body)
 
     return {
         "status": "ok"
     }
 
+@app.post("/api/push_feed")
+async def push_feed(request: Request, body: Dict):
+    # Standalone proxy service pushes its saved rows here
+    if request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+    feed_bus.publish(body)
+
+    return {
+        "status": "ok"
+    }
+
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from pathlib import Path
 
-# Make sure to set the correct path to your 'build' folder
-build_path = Path(__file__).parent / "config"
-app.mount("/static", StaticFiles(directory=build_path / "static"), name="static")
+@app.get("/static/{path_name:path}")
+async def static_files(request: Request, path_name: str):
+    return get_resource(request, "static/" + path_name)
 
 @app.get("/{path_name:path}", response_class=HTMLResponse)
-def receiver(path_name: str):
+async def receiver(request: Request, path_name: str):
     whitelist = [
         "",
         "log",
@@ -362,29 +558,124 @@ def receiver(path_name: str):
         if path_name == "" or path_name == "log" or path_name.endswith("login") or path_name.endswith("register"):
             path_name = "index.html"
 
-        return get_resource(path_name)
+        return get_resource(request, path_name)
 
 @app.websocket("/logging")
 async def websocket_endpoint(websocket: WebSocket):
-    global log_queues
-
-    new_queue = asyncio.Queue()
-    log_queues.add(new_queue)
+    # New clients get the recent history first, then live lines
+    subscription = log_hub.subscribe()
 
     try:
         await websocket.accept()
         while True:
-            obj = await new_queue.get()
+            obj = await subscription.get()
             await websocket.send_json(obj)
     except:
         pass
 
-    log_queues.remove(new_queue)
+    log_hub.unsubscribe(subscription)
+
+# Rows per frame on /stationdata, a burst is sent as several frames
+STREAM_BATCH_SIZE = 500
+
+async def stream_backfill(websocket: WebSocket, station: str, after_id: int) -> int:
+    # Pages forward from the cursor, memory first, until the station is caught up
+    while True:
+        records = station_cache.after(station, after_id, STREAM_BATCH_SIZE) if use_station_cache else None
+        if records is None:
+            records = await run_db(read_db.get_pos, station, None, after_id, None, STREAM_BATCH_SIZE)
+
+        if len(records) == 0:
+            return after_id
+
+        records = sorted(records, key=lambda record: record["Id"])
+        await websocket.send_json(jsonable_encoder({
+            "station": station,
+            "data": records,
+            "after": records[-1]["Id"]
+        }))
+
+        after_id = records[-1]["Id"]
+        if len(records) < STREAM_BATCH_SIZE:
+            return after_id
+
+async def stream_live(websocket: WebSocket, subscription: Subscription, cursors: Dict[str, int]):
+    dropped = subscription.dropped()
+
+    while True:
+        rows = await subscription.get_many(STREAM_BATCH_SIZE)
+
+        # The client fell behind and its buffer overflowed, the gap is read back from the DB
+        if subscription.dropped() != dropped:
+            dropped = subscription.dropped()
+            for station in cursors:
+                if cursors[station] is not None:
+                    cursors[station] = await stream_backfill(websocket, station, cursors[station])
+
+        records_by_station: Dict[str, List[Dict]] = dict()
+        for row in rows:
+            after_id = cursors.get(row["source"])
+            if after_id is not None and row["id"] <= after_id:
+                continue
+
+            records_by_station.setdefault(row["source"], []).append({
+                "Id": row["id"],
+                "TimeStamp": datetime.fromisoformat(row["created_at"]),
+                "Message": row["content"]
+            })
+
+        for station, records in records_by_station.items():
+            cursors[station] = records[-1]["Id"]
+            await websocket.send_json(jsonable_encoder({
+                "station": station,
+                "data": records,
+                "after": cursors[station]
+            }))
+
+async def wait_disconnect(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@app.websocket("/stationdata")
+async def stream_station_data(websocket: WebSocket):
+    # The client sends {"Stations": [...], "After": <id>} once, then gets rows as they are saved.
+    # "After" is the last Id the client has, every frame carries the cursor to resume from.
+    await websocket.accept()
+
+    subscription = None
+    try:
+        request = await websocket.receive_json()
+        stations = [ str(station) for station in request.get("Stations", []) ]
+        after_id = request.get("After")
+
+        # Subscribing before the backfill means nothing saved in between is missed
+        subscription = station_feed.subscribe(stations)
+        cursors: Dict[str, int] = { station: None for station in stations }
+
+        if after_id is not None:
+            for station in stations:
+                cursors[station] = await stream_backfill(websocket, station, int(after_id))
+
+        # An idle subscriber only notices a closed socket by reading from it
+        live = asyncio.ensure_future(stream_live(websocket, subscription, cursors))
+        closed = asyncio.ensure_future(wait_disconnect(websocket))
+        await asyncio.wait([ live, closed ], return_when=asyncio.FIRST_COMPLETED)
+        live.cancel()
+        closed.cancel()
+    except:
+        pass
+
+    if subscription is not None:
+        station_feed.unsubscribe(subscription)
 
-def run_web(queue: mp.Queue, log_to_file: bool, is_debug: bool = False):
+def run_web(queue: mp.Queue, log_to_file: bool, is_debug: bool = False, logs: mp.Queue = None, feed: mp.Queue = None):
     global app_queue
+    global log_queue
+    global feed_queue
 
     app_queue = queue
+    log_queue = logs
+    feed_queue = feed
 
     if log_to_file:
         logging.basicConfig(
@@ -407,12 +698,30 @@ def run_web(queue: mp.Queue, log_to_file: bool, is_debug: bool = False):
         )
 
     logging.info("Web logging is working well")
+
+    conf = Conf("conf.yaml")
+    workers = conf.get_web().workers
+
+    # Worker processes import the app by name and can't inherit the queues from run.py.
+    # Pushes over HTTP would reach one worker each, so live logs and feeds need a single one.
+    if workers > 1 and any(q is not None for q in (queue, logs, feed)):
+        logging.warning(
+            f"web.workers is { workers } but the web service was started with log and feed queues, "
+            f"running a single worker. Serve web:app with uvicorn --workers and { WEB_WORKERS_ENV } set to use several.")
+        workers = 1
+
+    if is_debug:
+        workers = 1
+
+    os.environ[WEB_WORKERS_ENV] = str(workers)
+
+    # The reloader re-imports the module in a child process, which would lose the queues
     uvicorn.run(
-        "web:app",
+        "web:app" if is_debug or workers > 1 else app,
         host=conf.get_agent_host(),
         port=conf.get_agent_port(),
-        reload=True,
-        workers=1,
+        reload=is_debug,
+        workers=workers,
         log_level="info")
 
 if __name__ == "__main__":